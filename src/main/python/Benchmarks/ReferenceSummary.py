@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import scipy.stats as st
+
+from DataAnalysis import DiffusionParameterData as dpd
+
+# The original summary implementation: one pandas Series and one mstats.mquantiles call per parameter over
+# the flattened values of every selected segment. Benchmarks time it and compare the engine's summaries
+# against it; it is not used by the viewer.
+
+
+# Returns the raw per segment values of each supported parameter of a loaded diffusion_parameters.mat
+def parse_reference_parameters(data):
+    raw = {key.replace(dpd.column_ending, ""): value for (key, value) in data.items() if
+           key.endswith(dpd.column_ending)}
+    return {key: pd.DataFrame(raw[key][-1]) for key in raw.keys() if key in dpd.supported_diffusion_parameters}
+
+
+# Returns the flattened values of a parameter over the given patient regions
+def get_reference_param_values(patient_entries, param_name, patient_to_regions):
+    values = []
+    for patient_identifier, regions in patient_to_regions.items():
+        diffusion_param = patient_entries[patient_identifier][param_name]
+        for i in regions:
+            values.extend(diffusion_param.at[i, 'values'][0].tolist())
+    return np.array(values)
+
+
+# Returns the summary row of one parameter exactly as the original implementation computed it
+def get_reference_param_summary(patient_entries, param_name, patient_to_regions):
+    if param_name == 'HA_lg * WALL_THICKNESS / 100':
+        values = np.multiply(get_reference_param_values(patient_entries, 'HA_lg', patient_to_regions),
+                             get_reference_param_values(patient_entries, 'WALL_THICKNESS', patient_to_regions)) / 100
+    else:
+        values = get_reference_param_values(patient_entries, param_name, patient_to_regions)
+    if param_name in dpd.absolute_value_parameters:
+        values = np.absolute(values)
+
+    series = pd.Series(values)
+    quartiles = st.mstats.mquantiles(values, [.25, .5, .75], alphap=0.5, betap=0.5)
+    summary = [param_name, series.mean(), series.std(), quartiles[1], quartiles[2] - quartiles[0], quartiles[0],
+               quartiles[2]]
+    if param_name in dpd.scale_parameters:
+        summary[1:] = [value * 1000 for value in summary[1:]]
+    return summary
+
+
+# Returns the original summary frame of every supported parameter over the given patient regions
+def get_reference_summary(patient_entries, patient_to_regions):
+    columns = ['Diffusion Parameter', 'Mean', 'Standard Deviation', 'Median', 'Interquartile Range',
+               'Lower Quartile', 'Upper Quartile']
+    return pd.DataFrame([get_reference_param_summary(patient_entries, param_name, patient_to_regions)
+                         for param_name in dpd.supported_diffusion_parameters], columns=columns)
+
+
+# Compares an engine summary with the reference summary, returning the largest relative difference of the
+# means and standard deviations and the largest absolute difference of the quartile columns
+def compare_summaries(summary, reference):
+    moments = ['Mean', 'Standard Deviation']
+    quartiles = ['Median', 'Interquartile Range', 'Lower Quartile', 'Upper Quartile']
+    expected = reference[moments].to_numpy(dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = np.abs(summary[moments].to_numpy(dtype=np.float64) - expected) / np.abs(expected)
+    return {
+        'moments_max_relative_difference': float(np.nanmax(relative)),
+        'quartiles_max_absolute_difference': float(np.nanmax(np.abs(
+            summary[quartiles].to_numpy(dtype=np.float64) - reference[quartiles].to_numpy(dtype=np.float64)))),
+    }
@@ -0,0 +1,90 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+from Benchmarks.SummaryBenchmark import get_environment, results_format, timing_metrics
+
+# Measures how long the viewer takes to show its window, e.g.
+#   python -m Benchmarks.StartupBenchmark --output startup.json --target 1.0
+# Each run starts a fresh interpreter, imports main, constructs the window and processes its first events.
+# The results record the time from launching the interpreter, the import and window construction times, and
+# the deferred modules that were already loaded when the window appeared. The exit status is non-zero when the
+# median startup time misses the target.
+
+default_repeats = 5
+default_target_seconds = 1.0
+
+# Run in a fresh interpreter; prints its measurements as JSON
+startup_script = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from PyQt5 import QtWidgets
+application = QtWidgets.QApplication(sys.argv)
+window = main.App()
+loaded = [module_name for module_name in main.deferred_modules if module_name in sys.modules]
+application.processEvents()
+shown = time.perf_counter()
+print(json.dumps({'shown': time.time(), 'import_seconds': imported - start, 'window_seconds': shown - imported,
+                  'deferred_modules_loaded': loaded}))
+'''
+
+
+# Starts the viewer once and returns its measurements
+def measure_startup(source_directory, platform=None):
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join([source_directory] + [path for path in [
+        environment.get('PYTHONPATH')] if path])
+    if platform:
+        environment['QT_QPA_PLATFORM'] = platform
+    launched = time.time()
+    output = subprocess.run([sys.executable, '-c', startup_script], cwd=source_directory, env=environment,
+                            stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    measurement = json.loads(output.strip().splitlines()[-1])
+    measurement['startup_seconds'] = measurement.pop('shown') - launched
+    return measurement
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the time until the viewer window appears.')
+    parser.add_argument('--repeats', type=int, default=default_repeats, help='number of fresh starts')
+    parser.add_argument('--target', type=float, default=default_target_seconds,
+                        help='median startup time to stay within, in seconds')
+    parser.add_argument('--platform', help='Qt platform plugin, e.g. offscreen on machines without a display')
+    parser.add_argument('--output', default='startup_results.json', help='JSON file to write the results to')
+    args = parser.parse_args(argv)
+
+    source_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    measurements = [measure_startup(source_directory, args.platform) for _ in range(args.repeats)]
+    metrics = {}
+    for name in ['startup', 'import', 'window']:
+        metrics.update(timing_metrics(name, [measurement[f'{name}_seconds'] for measurement in measurements]))
+    deferred_modules_loaded = sorted({module_name for measurement in measurements
+                                      for module_name in measurement['deferred_modules_loaded']})
+    results = {
+        'format': results_format,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'environment': get_environment(),
+        'settings': {'repeats': args.repeats, 'target_seconds': args.target, 'platform': args.platform},
+        'metrics': metrics,
+        'deferred_modules_loaded': deferred_modules_loaded,
+        'meets_target': bool(metrics['startup_seconds'] <= args.target),
+    }
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f'startup {metrics["startup_seconds"]:.3f} s (target {args.target:.3f} s), import '
+          f'{metrics["import_seconds"]:.3f} s, window {metrics["window_seconds"]:.3f} s')
+    if deferred_modules_loaded:
+        print(f'loaded before the window appeared: {", ".join(deferred_modules_loaded)}')
+    print(args.output)
+    return 0 if results['meets_target'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
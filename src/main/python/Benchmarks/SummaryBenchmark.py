@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy
+from scipy.io import loadmat
+
+from Benchmarks import ReferenceSummary as reference
+from Benchmarks.SyntheticStudy import default_image_shape, default_segment_voxels, generate_study
+from DataAnalysis import DiffusionParameterData as dpd
+from DataAnalysis.DataFrameModel import DataFrameModel
+from DataAnalysis.PatientFiles import get_diffusion_parameters_file, get_patient_identifier
+from DataAnalysis.Resampling import Resampler
+
+# Times the summary hot paths on synthetic cohorts and writes the results as JSON, e.g.
+#   python -m Benchmarks.SummaryBenchmark --sizes 1 10 100 1000 --output results.json --compare previous.json
+# For each cohort size the results hold flat metrics (seconds and bytes, lower is better) so runs of
+# different versions can be compared metric by metric. Cohorts up to --reference-limit patients are also
+# summarised with the original pandas + mquantiles implementation, recording its time and the largest
+# differences from the engine's summaries.
+
+results_format = 1
+default_cohort_sizes = [1, 10, 100, 1000]
+default_repeats = 5
+default_reference_limit = 100
+default_regression_threshold = 0.2
+
+
+# Returns the median, minimum and maximum of timing samples under the given metric name
+def timing_metrics(name, samples):
+    return {f'{name}_seconds': float(np.median(samples)), f'{name}_min_seconds': float(np.min(samples)),
+            f'{name}_max_seconds': float(np.max(samples))}
+
+
+# Returns the seconds taken by each call of function with each argument
+def time_calls(function, arguments):
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# Reads every patient with loadmat and adds it to a new registry, as the viewer originally loaded patients
+def load_cohort(directories, quantile_mode):
+    registry = dpd.DiffusionParameterData(quantile_mode)
+    for directory in directories:
+        registry.add_data(loadmat(get_diffusion_parameters_file(directory)), get_patient_identifier(directory))
+    return registry
+
+
+# Returns the peak traced memory in bytes of loading a cohort and summarising it once
+def measure_load_peak(directories, quantile_mode):
+    tracemalloc.start()
+    try:
+        load_cohort(directories, quantile_mode).get_combined_global_summary()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# Returns a random region selection for every patient and a sequence of (patient, region) toggles, as
+# clicked in the viewer's region checkboxes
+def get_region_selections(rng, patient_identifiers, toggle_count):
+    patient_to_regions = {}
+    for patient_identifier in patient_identifiers:
+        region_count = rng.integers(1, dpd.region_count + 1)
+        patient_to_regions[patient_identifier] = sorted(rng.choice(dpd.region_count, region_count,
+                                                                   replace=False).tolist())
+    toggles = [(patient_identifiers[rng.integers(len(patient_identifiers))], int(rng.integers(dpd.region_count)))
+               for _ in range(toggle_count)]
+    return patient_to_regions, toggles
+
+
+# Returns the successive selections produced by applying each toggle in turn
+def apply_toggles(patient_to_regions, toggles):
+    selections = []
+    for patient_identifier, region in toggles:
+        patient_to_regions = dict(patient_to_regions)
+        patient_to_regions[patient_identifier] = sorted(set(patient_to_regions[patient_identifier]) ^ {region})
+        selections.append(patient_to_regions)
+    return selections
+
+
+# Reads every cell of a table model as a table view repaint would
+def read_model(model):
+    for row in range(model.rowCount()):
+        for column in range(model.columnCount()):
+            model.data(model.index(row, column))
+
+
+# Runs every benchmark on the first patient_count patients and returns the metrics
+def benchmark_cohort(directories, repeats, quantile_mode, measure_memory, reference_limit, seed):
+    patient_count = len(directories)
+    metrics = {}
+
+    start = time.perf_counter()
+    registry = load_cohort(directories, quantile_mode)
+    metrics['load_seconds'] = time.perf_counter() - start
+    metrics['load_per_patient_seconds'] = metrics['load_seconds'] / patient_count
+    if measure_memory:
+        metrics['load_peak_bytes'] = measure_load_peak(directories, quantile_mode)
+
+    start = time.perf_counter()
+    global_summary = registry.get_combined_global_summary()
+    metrics['global_summary_cold_seconds'] = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    patient_identifiers = list(registry.patient_entries)
+    patient_to_regions, toggles = get_region_selections(rng, patient_identifiers, repeats)
+    start = time.perf_counter()
+    combined_summary = registry.get_combined_patient_regions_summary(patient_to_regions)
+    metrics['combined_regions_summary_cold_seconds'] = time.perf_counter() - start
+    metrics.update(timing_metrics('combined_regions_summary',
+                                  time_calls(registry.get_combined_patient_regions_summary,
+                                             apply_toggles(patient_to_regions, toggles))))
+
+    view = registry.get_patient_view(patient_identifiers[0])
+    region_selections = [[region for region in range(dpd.region_count) if region != excluded]
+                         for excluded in rng.integers(dpd.region_count, size=repeats)]
+    metrics.update(timing_metrics('regions_summary', time_calls(view.get_regions_summary, region_selections)))
+
+    metrics.update(timing_metrics('segment_statistics', time_calls(lambda _: registry.get_segment_statistics(),
+                                                                    range(repeats))))
+
+    registry.resampler = Resampler(seed=seed)
+    start = time.perf_counter()
+    registry.get_combined_global_summary()
+    metrics['bootstrap_global_summary_seconds'] = time.perf_counter() - start
+    registry.resampler = None
+
+    model = DataFrameModel(global_summary)
+    summaries = [combined_summary if i % 2 == 0 else global_summary for i in range(repeats)]
+    metrics.update(timing_metrics('table_model_update', time_calls(model.setDataFrame, summaries)))
+    metrics.update(timing_metrics('table_model_data', time_calls(read_model, [model] * repeats)))
+
+    if patient_count <= reference_limit:
+        start = time.perf_counter()
+        patient_entries = {get_patient_identifier(directory): reference.parse_reference_parameters(
+            loadmat(get_diffusion_parameters_file(directory))) for directory in directories}
+        metrics['reference_load_seconds'] = time.perf_counter() - start
+        start = time.perf_counter()
+        reference_global_summary = reference.get_reference_summary(patient_entries, registry.patient_global)
+        metrics['reference_global_summary_seconds'] = time.perf_counter() - start
+        start = time.perf_counter()
+        reference_combined_summary = reference.get_reference_summary(patient_entries, patient_to_regions)
+        metrics['reference_combined_regions_summary_seconds'] = time.perf_counter() - start
+        if quantile_mode == dpd.exact_quantile_mode:
+            differences = [reference.compare_summaries(global_summary, reference_global_summary),
+                           reference.compare_summaries(combined_summary, reference_combined_summary)]
+            for name in differences[0]:
+                metrics[f'reference_{name}'] = max(difference[name] for difference in differences)
+    return metrics
+
+
+# Returns the versions of the interpreter, libraries and source tree the results were measured with
+def get_environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True,
+                                  check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'revision': revision, 'platform': platform.platform(), 'processor': platform.processor(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'pandas': pd.__version__}
+
+
+# Returns the relative change of every metric shared with previous results, as (patients, metric, previous,
+# current, change) rows
+def compare_results(previous, current):
+    previous_metrics = {result['patients']: result['metrics'] for result in previous['results']}
+    changes = []
+    for result in current['results']:
+        for name, value in result['metrics'].items():
+            previous_value = previous_metrics.get(result['patients'], {}).get(name)
+            if previous_value and (name.endswith('_seconds') or name.endswith('_bytes')):
+                changes.append((result['patients'], name, previous_value, value, value / previous_value - 1))
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark diffusion parameter summaries on synthetic cohorts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_cohort_sizes, help='cohort sizes')
+    parser.add_argument('--repeats', type=int, default=default_repeats, help='timed calls per warm benchmark')
+    parser.add_argument('--voxels', type=int, nargs=2, default=default_segment_voxels, metavar=('MIN', 'MAX'),
+                        help='range of voxels per segment')
+    parser.add_argument('--study-root', help='synthetic study directory to reuse (default: a temporary one)')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='previous results to report changes against')
+    parser.add_argument('--threshold', type=float, default=default_regression_threshold,
+                        help='relative slow down reported as a regression')
+    parser.add_argument('--reference-limit', type=int, default=default_reference_limit,
+                        help='largest cohort also summarised with the original implementation')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced memory peak measurement')
+    parser.add_argument('--approximate-quartiles', action='store_true', help='benchmark approximate quartiles')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args(argv)
+
+    quantile_mode = dpd.approximate_quantile_mode if args.approximate_quartiles else dpd.exact_quantile_mode
+    study_root = args.study_root or tempfile.mkdtemp(prefix='dtcmr-benchmark-')
+    results = {
+        'format': results_format,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'environment': get_environment(),
+        'settings': {'seed': args.seed, 'repeats': args.repeats, 'segment_voxels': args.voxels,
+                     'image_shape': list(default_image_shape), 'quantile_mode': quantile_mode},
+        'results': [],
+    }
+    try:
+        directories = generate_study(study_root, max(args.sizes), args.seed, tuple(args.voxels))
+        for patient_count in sorted(args.sizes):
+            metrics = benchmark_cohort(directories[:patient_count], args.repeats, quantile_mode,
+                                       not args.no_memory, args.reference_limit, args.seed)
+            results['results'].append({'patients': patient_count, 'metrics': metrics})
+            print(f'{patient_count} patients: load {metrics["load_seconds"]:.3f} s, '
+                  f'global summary {metrics["global_summary_cold_seconds"]:.3f} s, '
+                  f'region toggle {metrics["combined_regions_summary_seconds"] * 1000:.1f} ms')
+    finally:
+        if args.study_root is None:
+            shutil.rmtree(study_root, ignore_errors=True)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(args.output)
+
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+        regressions = 0
+        for patient_count, name, previous_value, value, change in compare_results(previous, results):
+            regressed = change > args.threshold
+            regressions += regressed
+            print(f'{patient_count:>5} {name:<50} {previous_value:>14.6g} {value:>14.6g} {change:>+8.1%}'
+                  f'{"  REGRESSION" if regressed else ""}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
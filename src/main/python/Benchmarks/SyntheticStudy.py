@@ -0,0 +1,124 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+from scipy.io import savemat
+
+from DataAnalysis import DiffusionParameterData as dpd
+from DataAnalysis.PatientFiles import get_diffusion_parameters_file
+
+# Synthetic studies laid out like real exports, e.g.
+#   python -m Benchmarks.SyntheticStudy STUDY_ROOT --patients 100 --voxels 50 300
+# Every patient directory gets a result_images/exported_data/diffusion_parameters.mat holding one 1x12
+# struct array per parameter (X_12_seg, with a (1, n) 'values' field per AHA segment) next to an image
+# volume that the viewer never reads. Patients are generated from their own seed, so a study can be grown
+# and every patient's file is identical between runs.
+
+default_segment_voxels = (50, 300)
+default_image_shape = (64, 64, 12)
+
+
+# Returns the directory of the index-th synthetic patient
+def get_patient_directory(study_root, index):
+    return os.path.join(study_root, f'patient_{index:04d}')
+
+
+# Wraps angles in degrees into [-90, 90)
+def wrap_angles(angles):
+    return (angles + 90) % 180 - 90
+
+
+# Returns plausible values of every exported parameter for the voxels of one segment
+def generate_segment_parameters(rng, voxel_count):
+    # Tensor eigenvalues in mm^2/s, ordered largest first
+    eigenvalues = -np.sort(-rng.normal([1.6e-3, 1.2e-3, 0.8e-3], 0.15e-3, size=(voxel_count, 3)), axis=1)
+    eigenvalues = np.maximum(eigenvalues, 1e-5)
+    md = eigenvalues.mean(axis=1)
+    deviations = eigenvalues - md[:, np.newaxis]
+    norm = np.sqrt(np.square(deviations).sum(axis=1))
+    fa = np.sqrt(1.5) * norm / np.sqrt(np.square(eigenvalues).sum(axis=1))
+    mode = 3 * np.sqrt(6) * np.prod(deviations, axis=1) / np.maximum(norm, 1e-12) ** 3
+
+    # Helix angles rotate from endocardium to epicardium across the wall
+    depth = rng.uniform(size=voxel_count)
+    wall_thickness = rng.normal(10, 1.5)
+    return {
+        'E1': eigenvalues[:, 0],
+        'E2': eigenvalues[:, 1],
+        'E3': eigenvalues[:, 2],
+        'FA': fa,
+        'MD': md,
+        'MODE': np.clip(mode, -1, 1),
+        'HA': wrap_angles(60 - 120 * depth + rng.normal(0, 10, voxel_count)),
+        'E2A': wrap_angles(rng.normal(rng.normal(15, 5), 25, voxel_count)),
+        'IA': wrap_angles(rng.normal(0, 10, voxel_count)),
+        'TA': wrap_angles(rng.normal(0, 10, voxel_count)),
+        'HA_lg': rng.normal(rng.normal(-1.2, 0.2), 0.3, voxel_count),
+        'WALL_THICKNESS': np.maximum(rng.normal(wall_thickness, 0.3, voxel_count), 1),
+    }
+
+
+# Returns the variables of a synthetic diffusion_parameters.mat, with segment voxel counts drawn from
+# segment_voxels (inclusive) and a fraction of NaN values
+def generate_diffusion_parameters(rng, segment_voxels=default_segment_voxels, image_shape=default_image_shape,
+                                  nan_fraction=0.0):
+    voxel_counts = rng.integers(segment_voxels[0], segment_voxels[1] + 1, size=dpd.region_count)
+    segments = [generate_segment_parameters(rng, voxel_count) for voxel_count in voxel_counts]
+    data = {}
+    for param_name in dpd.exported_diffusion_parameters:
+        struct = np.empty((1, dpd.region_count), dtype=[('values', object)])
+        for region, segment in enumerate(segments):
+            values = segment[param_name]
+            if nan_fraction:
+                values = np.where(rng.uniform(size=len(values)) < nan_fraction, np.nan, values)
+            struct[0, region]['values'] = values[np.newaxis, :]
+        data[param_name + dpd.column_ending] = struct
+    if image_shape:
+        data['DTI_images'] = rng.normal(size=image_shape).astype(np.float32)
+    return data
+
+
+# Writes the diffusion_parameters.mat of the index-th synthetic patient unless it already exists, and returns
+# the patient directory
+def write_patient(study_root, index, seed=0, segment_voxels=default_segment_voxels,
+                  image_shape=default_image_shape, nan_fraction=0.0):
+    patient_data_directory = get_patient_directory(study_root, index)
+    dp_file_path = get_diffusion_parameters_file(patient_data_directory)
+    if not os.path.exists(dp_file_path):
+        os.makedirs(os.path.dirname(dp_file_path), exist_ok=True)
+        rng = np.random.default_rng([seed, index])
+        data = generate_diffusion_parameters(rng, segment_voxels, image_shape, nan_fraction)
+        # MATLAB's default -v7 format compresses each variable
+        savemat(dp_file_path + '.tmp', data, do_compression=True)
+        os.replace(dp_file_path + '.tmp', dp_file_path)
+    return patient_data_directory
+
+
+# Generates the first patient_count patients of a synthetic study and returns their directories
+def generate_study(study_root, patient_count, seed=0, segment_voxels=default_segment_voxels,
+                   image_shape=default_image_shape, nan_fraction=0.0):
+    return [write_patient(study_root, index, seed, segment_voxels, image_shape, nan_fraction)
+            for index in range(patient_count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic DT-CMR study.')
+    parser.add_argument('study_root', help='directory to create one sub-directory per patient in')
+    parser.add_argument('--patients', type=int, default=10, help='number of patients')
+    parser.add_argument('--voxels', type=int, nargs=2, default=default_segment_voxels, metavar=('MIN', 'MAX'),
+                        help='range of voxels per segment')
+    parser.add_argument('--image-shape', type=int, nargs='*', default=default_image_shape,
+                        help='shape of the unused image volume stored alongside (none to omit it)')
+    parser.add_argument('--nan-fraction', type=float, default=0.0, help='fraction of NaN values')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args(argv)
+
+    directories = generate_study(args.study_root, args.patients, args.seed, tuple(args.voxels),
+                                 tuple(args.image_shape), args.nan_fraction)
+    print(f'{len(directories)} patients in {args.study_root}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
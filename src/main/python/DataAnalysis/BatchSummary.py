@@ -0,0 +1,218 @@
+import argparse
+import csv
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+from functools import partial
+
+import pandas as pd
+
+from DataAnalysis import DiffusionParameterData as dpd
+from DataAnalysis.DerivedParameters import DerivedParameter
+from DataAnalysis.MemoryBudget import MemoryBudget, memory_budget_environment_variable
+from DataAnalysis.ParsedDataCache import ParsedDataCache, default_cache_directory
+from DataAnalysis.PatientFiles import get_diffusion_parameters_file, get_patient_identifier, load_patient
+from DataAnalysis.Profiler import profiled_call, profiler
+from DataAnalysis.QuantileSketch import rank_error
+from DataAnalysis.Resampling import Resampler, default_replicates
+
+# Headless cohort summaries, e.g.
+#   python -m DataAnalysis.BatchSummary STUDY_ROOT --regions regions.csv --output summaries --format parquet
+# Region selection files map patient identifiers to 1-based AHA segments, either as JSON
+# ({"patient": [1, 2, 3]}) or as CSV rows of a patient identifier followed by its segments.
+
+output_formats = ['csv', 'parquet']
+# Libraries pandas can write Parquet with, one of which must be installed for --format parquet
+parquet_engines = ['pyarrow', 'fastparquet']
+# With a memory budget, the combined registry is brought within it after every this many patients
+memory_budget_interval = 16
+
+
+# Returns the patient directories of a study root that contain exported diffusion parameters
+def find_patient_directories(study_root):
+    directories = []
+    for name in sorted(os.listdir(study_root)):
+        patient_data_directory = os.path.join(study_root, name)
+        if os.path.isfile(get_diffusion_parameters_file(patient_data_directory)):
+            directories.append(patient_data_directory)
+    return directories
+
+
+# Reads a region selection file into a dictionary of patient identifiers to 0-based regions
+def read_region_selections(path):
+    if path.lower().endswith('.json'):
+        with open(path) as file:
+            selections = json.load(file)
+    else:
+        with open(path, newline='') as file:
+            selections = {row[0].strip(): [cell for cell in row[1:] if cell.strip()] for row in csv.reader(file)
+                          if row and row[0].strip()}
+    patient_regions = {}
+    for patient_identifier, segments in selections.items():
+        regions = sorted({int(segment) - 1 for segment in segments})
+        if any(region < 0 or region > 11 for region in regions):
+            raise ValueError(f'Region selection for {patient_identifier} must use segments 1 to 12')
+        patient_regions[str(patient_identifier)] = regions
+    return patient_regions
+
+
+# Returns an empty registry with the given quantile mode, derived parameter expressions and resampler
+def get_registry(quantile_mode, derived_parameters, resampler=None):
+    registry = dpd.DiffusionParameterData(quantile_mode)
+    for expression in derived_parameters:
+        registry.add_derived_parameter(expression)
+    registry.resampler = resampler
+    return registry
+
+
+# Loads one patient and summarises it; run in worker processes
+def summarise_patient(task):
+    patient_data_directory, regions, cache, quantile_mode, derived_parameters, resampling = task
+    try:
+        patient = load_patient(patient_data_directory, cache)
+    except Exception as error:
+        return patient_data_directory, None, None, str(error)
+    resampler = Resampler(resampling[0], seed=resampling[1]) if resampling else None
+    registry = get_registry(quantile_mode, derived_parameters, resampler)
+    view = registry.add_parameters(patient.diffusion_parameters, patient.identifier, patient.statistics)
+    summaries = [('Global', view.get_global_summary())]
+    if regions:
+        summaries.append(('Selected Regions', view.get_regions_summary(regions)))
+    tables = []
+    for selection, summary in summaries:
+        summary.insert(0, 'Selection', selection)
+        summary.insert(0, 'Patient', patient.identifier)
+        tables.append(summary)
+    return patient_data_directory, patient, pd.concat(tables, ignore_index=True), None
+
+
+# Writes a summary table in the requested format
+def write_table(table, output_directory, name, output_format):
+    path = os.path.join(output_directory, f'{name}.{output_format}')
+    if output_format == 'parquet':
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+    return path
+
+
+# Parses and summarises a study root, writing global, per patient, per segment and combined summary tables.
+# resampling is a (replicates, seed) pair that adds bootstrap intervals to the summaries and compares the
+# selected with the unselected regions. memory_budget is a MemoryBudget the combined patients are kept within.
+def run(study_root, output_directory, output_format='csv', region_selections=None, processes=None, cache=None,
+        quantile_mode=dpd.exact_quantile_mode, derived_parameters=(), resampling=None, memory_budget=None):
+    region_selections = region_selections or {}
+    resampler = Resampler(resampling[0], seed=resampling[1], processes=processes) if resampling else None
+    combined = get_registry(quantile_mode, derived_parameters, resampler)
+    combined.memory_budget = memory_budget
+    tasks = [(directory, region_selections.get(get_patient_identifier(directory), []), cache, quantile_mode,
+              derived_parameters, resampling) for directory in find_patient_directories(study_root)]
+
+    patient_tables = []
+    errors = []
+    profiling = profiler.enabled
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(partial(profiled_call, summarise_patient) if profiling
+                                          else summarise_patient, tasks):
+            if profiling:
+                result, events = result
+                profiler.add_events(events)
+            directory, patient, table, error = result
+            if error is not None:
+                errors.append(f'{directory}: {error}')
+                continue
+            combined.add_parameters(patient.diffusion_parameters, patient.identifier, patient.statistics)
+            patient_tables.append(table)
+            if memory_budget is not None and len(patient_tables) % memory_budget_interval == 0:
+                combined.enforce_memory_budget()
+
+    os.makedirs(output_directory, exist_ok=True)
+    try:
+        combined.enforce_memory_budget()
+        written = [write_table(combined.get_combined_global_summary(), output_directory, 'global_summary',
+                               output_format)]
+        if patient_tables:
+            patient_summaries = pd.concat(patient_tables, ignore_index=True).sort_values(['Patient'], kind='stable')
+            written.append(write_table(patient_summaries, output_directory, 'patient_summaries', output_format))
+        if combined.patient_entries:
+            written.append(write_table(combined.get_segment_statistics_frame(), output_directory,
+                                       'segment_statistics', output_format))
+        selected = {patient_identifier: regions for patient_identifier, regions in region_selections.items()
+                    if patient_identifier in combined.patient_entries and regions}
+        if selected:
+            written.append(write_table(combined.get_combined_patient_regions_summary(selected), output_directory,
+                                       'combined_regions_summary', output_format))
+        if selected and resampling:
+            unselected = {patient_identifier: [region for region in range(dpd.region_count)
+                                               if region not in regions]
+                          for patient_identifier, regions in selected.items()}
+            written.append(write_table(combined.get_selection_comparison(unselected, selected), output_directory,
+                                       'regions_comparison', output_format))
+    finally:
+        if resampler is not None:
+            resampler.close()
+        if memory_budget is not None:
+            memory_budget.close()
+    return written, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarise the diffusion parameters of a DT-CMR study.')
+    parser.add_argument('study_root', help='directory containing one sub-directory per patient')
+    parser.add_argument('--regions', help='JSON or CSV file of 1-based region selections per patient')
+    parser.add_argument('--output', default='.', help='directory to write the summary tables to')
+    parser.add_argument('--format', choices=output_formats, default='csv', help='summary table file format')
+    parser.add_argument('--processes', type=int, help='number of worker processes (default: all cores)')
+    parser.add_argument('--cache', default=default_cache_directory, help='parsed data cache directory')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the .mat files')
+    parser.add_argument('--derived', action='append', default=[], metavar='EXPRESSION',
+                        help="summarise a derived parameter, e.g. 'FA * MD' (repeatable)")
+    parser.add_argument('--bootstrap', type=int, nargs='?', const=default_replicates, metavar='REPLICATES',
+                        help=f'add patient level bootstrap intervals of the median and IQR, and compare selected '
+                             f'with unselected regions (default: {default_replicates} replicates)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the bootstrap and permutation tests')
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help=f'store values as float32 and move patients to memory-mapped files to keep the values '
+                             f'held in memory within this many megabytes (default: '
+                             f'${memory_budget_environment_variable}, if set)')
+    parser.add_argument('--profile', metavar='TRACE', help='write a Chrome trace of the loading and summary stages')
+    parser.add_argument('--approximate-quartiles', action='store_true',
+                        help=f'estimate quartiles from quantile sketches '
+                             f'(within \u00b1{rank_error * 100:.2f}%% in rank)')
+    args = parser.parse_args(argv)
+
+    if args.format == 'parquet' and not any(importlib.util.find_spec(engine) for engine in parquet_engines):
+        parser.error(f'--format parquet needs {" or ".join(parquet_engines)} to be installed')
+    for expression in args.derived:
+        try:
+            DerivedParameter(expression, dpd.exported_diffusion_parameters)
+        except ValueError as error:
+            parser.error(str(error))
+    region_selections = read_region_selections(args.regions) if args.regions else None
+    cache = None if args.no_cache else ParsedDataCache(args.cache)
+    quantile_mode = dpd.approximate_quantile_mode if args.approximate_quartiles else dpd.exact_quantile_mode
+    if args.profile:
+        profiler.enable()
+    if args.bootstrap is not None and args.bootstrap < 1:
+        parser.error('--bootstrap needs at least one replicate')
+    if args.memory_budget is not None and args.memory_budget <= 0:
+        parser.error('--memory-budget must be positive')
+    memory_budget = MemoryBudget(int(args.memory_budget * 1024 ** 2)) if args.memory_budget else \
+        MemoryBudget.from_environment()
+    written, errors = run(args.study_root, args.output, args.format, region_selections, args.processes, cache,
+                          quantile_mode, args.derived, (args.bootstrap, args.seed) if args.bootstrap else None,
+                          memory_budget)
+    if args.profile:
+        profiler.export_chrome_trace(args.profile)
+        written.append(args.profile)
+    for error in errors:
+        print(error, file=sys.stderr)
+    for path in written:
+        print(path)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,63 +1,87 @@
-import pandas as pd
+import numpy as np
 from PyQt5 import QtCore
 
 
-# Used to convert panda data frame to a QTableModel
+# Formats a cell value for display
+def format_value(val):
+    if isinstance(val, float):
+        # Format to 4.s.f
+        return "{0:.4g}".format(val)
+    return str(val)
+
+
+# Used to convert panda data frame to a QTableModel. Cell values and their display strings are held in
+# NumPy arrays built once per update, and updating a frame of the same shape only signals the cells whose
+# displayed value changed. Frames are only used through their methods, so pandas is not imported here.
 class DataFrameModel(QtCore.QAbstractTableModel):
     DtypeRole = QtCore.Qt.UserRole + 1000
     ValueRole = QtCore.Qt.UserRole + 1001
 
-    def __init__(self, df=pd.DataFrame(), parent=None):
+    def __init__(self, df, parent=None):
         super(DataFrameModel, self).__init__(parent)
-        self._dataframe = df
+        self._set_arrays(df)
+
+    def _set_arrays(self, dataframe):
+        self._dataframe = dataframe
+        self._values = dataframe.to_numpy(dtype=object)
+        self._display = np.array([format_value(val) for val in self._values.ravel()],
+                                 dtype=object).reshape(self._values.shape)
+        self._columns = [str(column) for column in dataframe.columns]
+        self._index = [str(label) for label in dataframe.index]
+        self._dtypes = list(dataframe.dtypes)
 
+    # Replaces the frame, resetting the model only when its shape or labels change. Returns whether the model
+    # was reset.
     def setDataFrame(self, dataframe):
-        self.beginResetModel()
-        self._dataframe = dataframe.copy()
-        self.endResetModel()
+        if list(dataframe.columns) != list(self._dataframe.columns) or \
+                list(dataframe.index) != list(self._dataframe.index):
+            self.beginResetModel()
+            self._set_arrays(dataframe)
+            self.endResetModel()
+            return True
+
+        previous_display = self._display
+        self._set_arrays(dataframe)
+        changed = self._display != previous_display
+        for row in np.flatnonzero(changed.any(axis=1)):
+            columns = np.flatnonzero(changed[row])
+            self.dataChanged.emit(self.index(row, columns[0]), self.index(row, columns[-1]))
+        return False
 
     def dataFrame(self):
         return self._dataframe
 
-    dataFrame = QtCore.pyqtProperty(pd.DataFrame, fget=dataFrame, fset=setDataFrame)
+    dataFrame = QtCore.pyqtProperty(object, fget=dataFrame, fset=setDataFrame)
 
     @QtCore.pyqtSlot(int, QtCore.Qt.Orientation, result=str)
     def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: int = QtCore.Qt.DisplayRole):
         if role == QtCore.Qt.DisplayRole:
             if orientation == QtCore.Qt.Horizontal:
-                return self._dataframe.columns[section]
+                return self._columns[section]
             else:
-                return str(self._dataframe.index[section])
+                return self._index[section]
         return QtCore.QVariant()
 
     def rowCount(self, parent=QtCore.QModelIndex()):
         if parent.isValid():
             return 0
-        return len(self._dataframe.index)
+        return self._values.shape[0]
 
     def columnCount(self, parent=QtCore.QModelIndex()):
         if parent.isValid():
             return 0
-        return self._dataframe.columns.size
+        return self._values.shape[1]
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
-        if not index.isValid() or not (0 <= index.row() < self.rowCount()
-                                       and 0 <= index.column() < self.columnCount()):
+        row, column = index.row(), index.column()
+        if not index.isValid() or not (0 <= row < self._values.shape[0] and 0 <= column < self._values.shape[1]):
             return QtCore.QVariant()
-        row = self._dataframe.index[index.row()]
-        col = self._dataframe.columns[index.column()]
-        dt = self._dataframe[col].dtype
-
-        val = self._dataframe.iloc[row][col]
         if role == QtCore.Qt.DisplayRole:
-            if isinstance(val, float):
-                # Format to 4.s.f
-                return "{0:.4g}".format(val)
-            return str(val)
+            return self._display[row, column]
         elif role == DataFrameModel.ValueRole:
-            return val
+            return self._values[row, column]
         if role == DataFrameModel.DtypeRole:
-            return dt
+            return self._dtypes[column]
         return QtCore.QVariant()
 
     def roleNames(self):
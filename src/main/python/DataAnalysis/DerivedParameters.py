@@ -0,0 +1,78 @@
+import ast
+
+import numpy as np
+
+from DataAnalysis.SegmentedArray import SegmentedArray
+
+# Functions derived parameter expressions may call, applied element-wise
+expression_functions = {
+    'abs': np.absolute, 'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log, 'log10': np.log10,
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'arcsin': np.arcsin, 'arccos': np.arccos, 'arctan': np.arctan,
+    'arctan2': np.arctan2, 'degrees': np.degrees, 'radians': np.radians, 'minimum': np.minimum,
+    'maximum': np.maximum,
+}
+expression_operators = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+
+
+# Returns whether a node is a number; Python 3.7 parses numbers as ast.Num, later versions as ast.Constant
+def is_number(node):
+    value = node.value if isinstance(node, ast.Constant) else getattr(node, 'n', None)
+    return type(value) in (int, float)
+
+
+# A parameter computed element-wise from exported diffusion parameters, e.g. 'HA_lg * WALL_THICKNESS / 100'.
+# The expression is parsed, validated and compiled once; it may only use the given parameter names, numbers,
+# arithmetic operators and the functions in expression_functions.
+class DerivedParameter:
+    def __init__(self, expression, parameter_names, name=None):
+        self.expression = expression.strip()
+        self.name = name.strip() if name else self.expression
+        try:
+            tree = ast.parse(self.expression, mode='eval')
+        except SyntaxError as error:
+            raise ValueError(f'Derived parameter {self.name} is not a valid expression: {error.msg}')
+        self.parameters = sorted(self.validate(tree.body, set(parameter_names)))
+        if not self.parameters:
+            raise ValueError(f'Derived parameter {self.name} does not use any diffusion parameter')
+        self.code = compile(tree, f'<{self.name}>', 'eval')
+
+    # Checks every node of an expression is allowed, returning the diffusion parameters it uses
+    def validate(self, node, parameter_names):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, expression_operators):
+            return self.validate(node.left, parameter_names) | self.validate(node.right, parameter_names)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, expression_operators):
+            return self.validate(node.operand, parameter_names)
+        if is_number(node):
+            return set()
+        if isinstance(node, ast.Name):
+            if node.id not in parameter_names:
+                raise ValueError(f'Derived parameter {self.name} uses unknown parameter {node.id}')
+            return {node.id}
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            if node.func.id not in expression_functions:
+                raise ValueError(f'Derived parameter {self.name} uses unknown function {node.func.id}')
+            if len(node.args) != expression_functions[node.func.id].nin:
+                raise ValueError(f'Derived parameter {self.name} calls {node.func.id} with '
+                                 f'{len(node.args)} arguments instead of {expression_functions[node.func.id].nin}')
+            used = set()
+            for argument in node.args:
+                used |= self.validate(argument, parameter_names)
+            return used
+        raise ValueError(f'Derived parameter {self.name} may only use parameters, numbers, arithmetic and '
+                         f'{", ".join(sorted(expression_functions))}')
+
+    # Returns whether the parameters the expression needs are all available
+    def is_available(self, param_names):
+        return all(param_name in param_names for param_name in self.parameters)
+
+    # Evaluates the expression over the values of every segment of one patient at once
+    def evaluate(self, diffusion_parameters):
+        sources = [diffusion_parameters[param_name] for param_name in self.parameters]
+        offsets = sources[0].offsets
+        if any(not np.array_equal(source.offsets, offsets) for source in sources[1:]):
+            raise ValueError(f'Derived parameter {self.name} combines parameters with different segment sizes')
+        namespace = dict(expression_functions)
+        namespace.update(zip(self.parameters, (np.asarray(source.values) for source in sources)))
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            values = eval(self.code, {'__builtins__': {}}, namespace)
+        return SegmentedArray(np.asarray(values, dtype=np.float64), offsets)
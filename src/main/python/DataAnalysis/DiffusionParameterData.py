@@ -1,96 +1,409 @@
+import threading
+from collections.abc import Mapping
+from functools import partial
+
 import numpy as np
-import pandas as pd
-import scipy.stats as st
+
+from DataAnalysis.DerivedParameters import DerivedParameter
+from DataAnalysis.LazyMapping import LazyMapping
+from DataAnalysis.MemoryBudget import is_file_backed
+from DataAnalysis.Profiler import instrumented
+from DataAnalysis.Resampling import ClusteredComparison, ClusteredValues, Resampler
+from DataAnalysis.SegmentStatistics import CohortAggregate, SegmentStatistics
+from DataAnalysis.SegmentedArray import SegmentedArray, concatenate_slices
+from DataAnalysis.SummaryEngine import add_interval_columns, approximate_quartiles_batch, exact_quartiles_batch, \
+    segment_quartiles_batch, segment_statistic_columns, summarise_comparisons, summarise_parameters, \
+    summarise_segments
 
 column_ending = '_12_seg'
-supported_diffusion_parameters = ['E1', 'E2', 'E3', 'FA', 'MD', 'MODE',
-                                  'HA', 'E2A', 'IA', 'TA', 'HA_lg', 'WALL_THICKNESS', 'HA_lg * WALL_THICKNESS / 100']
+exported_diffusion_parameters = ['E1', 'E2', 'E3', 'FA', 'MD', 'MODE',
+                                 'HA', 'E2A', 'IA', 'TA', 'HA_lg', 'WALL_THICKNESS']
+# Derived parameters every registry starts with; registries can define more with add_derived_parameter
+default_derived_parameters = {derived.name: derived for derived in [
+    DerivedParameter('HA_lg * WALL_THICKNESS / 100', exported_diffusion_parameters)]}
+supported_diffusion_parameters = exported_diffusion_parameters + list(default_derived_parameters)
+absolute_value_parameters = ['E2A', 'TA']
+scale_parameters = ['E1', 'E2', 'E3']
+region_count = 12
+
+# Quartiles are computed exactly from every selected value, or approximately from merged per segment quantile
+# sketches whose error bound is given by QuantileSketch.rank_error
+exact_quantile_mode = 'exact'
+approximate_quantile_mode = 'approximate'
+
+# Number of cohort aggregates kept so that alternating selections (global, combined, per patient) each
+# reuse their own sorted values
+max_cached_aggregates = 8
+
+
+# Gets diffusion parameter as a contiguous segmented value store
+def get_diffusion_parameter(param_name, raw):
+    data = raw[param_name]
+    return SegmentedArray.from_segments(values[0] for values in data[-1]['values'])
+
+
+# Parses the supported diffusion parameters of a loaded diffusion_parameters.mat dictionary
+def parse_diffusion_parameters(data):
+    raw = {key.replace(column_ending, ""): value for (key, value) in data.items() if
+           key.endswith(column_ending)}
+    return {key: get_diffusion_parameter(key, raw) for key in raw.keys() if
+            key in supported_diffusion_parameters}
+
+
+# Computes the per segment statistics of the values of one parameter of a patient
+@instrumented('segment statistics')
+def get_values_statistics(param_name, values):
+    if param_name in absolute_value_parameters:
+        values = SegmentedArray(np.absolute(values.values), values.offsets)
+    return SegmentStatistics.from_values(values)
+
+
+# Computes the per segment statistics of one exported or default derived parameter of a patient
+def get_parameter_statistics(param_name, diffusion_parameters):
+    if param_name in default_derived_parameters:
+        return get_values_statistics(param_name, default_derived_parameters[param_name].evaluate(diffusion_parameters))
+    return get_values_statistics(param_name, diffusion_parameters[param_name])
+
+
+# Returns the parameters that statistics can be computed for from the given exported parameters
+def get_statistics_parameters(param_names):
+    param_names = set(param_names)
+    return [param_name for param_name in exported_diffusion_parameters if param_name in param_names] + \
+        [name for name, derived in default_derived_parameters.items() if derived.is_available(param_names)]
 
 
-def __flatten__(list):
-    return [item for sublist in list for item in sublist]
+# Caches per segment statistics of every parameter of a patient
+def get_patient_statistics(diffusion_parameters):
+    return {param_name: get_parameter_statistics(param_name, diffusion_parameters)
+            for param_name in get_statistics_parameters(diffusion_parameters)}
+
+
+# Per segment statistics of a patient that are only computed when a summary first needs each parameter
+def get_lazy_patient_statistics(diffusion_parameters):
+    return LazyMapping(get_statistics_parameters(diffusion_parameters),
+                       partial(get_parameter_statistics, diffusion_parameters=diffusion_parameters))
+
+
+# Returns the keys of a mapping whose values exist, without creating those of a lazy mapping
+def materialized(mapping):
+    return mapping.materialized() if isinstance(mapping, LazyMapping) else list(mapping)
+
+
+# Groups a selection of (patient, region) pairs into a dictionary of patient identifiers to sorted regions
+def get_selection_regions(selection):
+    patient_to_regions = {}
+    for patient_identifier, region in sorted(selection):
+        patient_to_regions.setdefault(patient_identifier, []).append(region)
+    return patient_to_regions
+
+
+# Flattens the result of DiffusionParameterData.get_segment_statistics into a panda data frame with one row
+# per patient, 1-based segment and diffusion parameter
+def get_segment_statistics_frame(segment_statistics):
+    import pandas as pd
+    patient_identifiers, param_names, statistics = segment_statistics
+    patients, regions, params = np.meshgrid(np.arange(len(patient_identifiers)), np.arange(region_count),
+                                            np.arange(len(param_names)), indexing='ij')
+    frame = pd.DataFrame(statistics.reshape(-1, len(segment_statistic_columns)), columns=segment_statistic_columns)
+    frame.insert(0, 'Diffusion Parameter', np.array(param_names, dtype=object)[params.ravel()])
+    frame.insert(0, 'Segment', regions.ravel() + 1)
+    frame.insert(0, 'Patient', np.array(patient_identifiers, dtype=object)[patients.ravel()])
+    return frame
 
 
 # Data analysis class for diffusion parameter data
 class DiffusionParameterData:
-    def __init__(self):
+    def __init__(self, quantile_mode=exact_quantile_mode):
+        self.quantile_mode = quantile_mode
         self.patient_entries = {}
         self.patient_global = {}
+        self.patient_statistics = {}
+        self.patient_moments = {}
+        self.aggregates = []
+        self.derived_parameters = dict(default_derived_parameters)
+        # Values and statistics of derived parameters keyed by (patient identifier, parameter name)
+        self.derived_values = {}
+        self.derived_statistics = {}
+        # When set to a Resampler, summaries also hold bootstrap intervals of the median and interquartile range
+        self.resampler = None
+        # When set to a MemoryBudget, enforce_memory_budget keeps the resident values within it
+        self.memory_budget = None
+        # Guards the registry so summaries can be computed on a worker thread whilst patients are added
+        # or removed on the GUI thread
+        self.lock = threading.RLock()
 
     # Sets class members
     def add_data(self, data, patient_identifier):
         if patient_identifier not in self.patient_entries:
-            raw = {key.replace(column_ending, ""): value for (key, value) in data.items() if
-                   key.endswith(column_ending)}
-            diffusion_parameters = {key: self.get_diffusion_parameter(key, raw) for key in raw.keys() if
-                                    key in supported_diffusion_parameters}
+            self.add_parameters(parse_diffusion_parameters(data), patient_identifier)
+        return self.get_patient_view(patient_identifier)
+
+    # Adds already parsed diffusion parameters, reusing their statistics when they were computed elsewhere.
+    # Otherwise statistics are computed the first time a summary needs each parameter.
+    @instrumented('add_data', 'load')
+    def add_parameters(self, diffusion_parameters, patient_identifier, statistics=None):
+        with self.lock:
+            if patient_identifier not in self.patient_entries:
+                self.patient_entries[patient_identifier] = diffusion_parameters
+                self.patient_global[patient_identifier] = range(0, region_count)
+                self.patient_statistics[patient_identifier] = PatientStatisticsView(
+                    self, patient_identifier, statistics if statistics is not None else
+                    get_lazy_patient_statistics(diffusion_parameters))
+                self.touch_patient(patient_identifier)
+            return self.get_patient_view(patient_identifier)
 
+    # Replaces a patient's data with that of a re-export, keeping its position among the patients. Cached cohort
+    # aggregates drop the old values and merge in the new ones when next summarised, rather than being rebuilt.
+    @instrumented('replace_data', 'load')
+    def replace_parameters(self, diffusion_parameters, patient_identifier, statistics=None):
+        with self.lock:
+            if patient_identifier not in self.patient_entries:
+                return self.add_parameters(diffusion_parameters, patient_identifier, statistics)
+            selections = [aggregate.selection for aggregate in self.aggregates]
+            self.remove_patient_contribution(patient_identifier)
             self.patient_entries[patient_identifier] = diffusion_parameters
-            self.patient_global[patient_identifier] = range(0, 12)
-        return self.get_combined_global_summary()
+            self.patient_statistics[patient_identifier] = PatientStatisticsView(
+                self, patient_identifier, statistics if statistics is not None else
+                get_lazy_patient_statistics(diffusion_parameters))
+            for aggregate, selection in zip(self.aggregates, selections):
+                aggregate.selection = selection
+            self.touch_patient(patient_identifier)
+            return self.get_patient_view(patient_identifier)
+
+    # Marks a patient as the most recently viewed, so the memory budget spills it last
+    def touch_patient(self, patient_identifier):
+        with self.lock:
+            if self.memory_budget is not None:
+                self.memory_budget.touch(patient_identifier)
+
+    # Returns the value stores of a patient's parameters, statistics and derived parameters that have been read
+    # or computed so far
+    def get_patient_arrays(self, patient_identifier):
+        diffusion_parameters = self.patient_entries[patient_identifier]
+        statistics = self.patient_statistics[patient_identifier].statistics
+        arrays = [diffusion_parameters[param_name] for param_name in materialized(diffusion_parameters)]
+        param_statistics = [statistics[param_name] for param_name in materialized(statistics)]
+        for param_name in self.derived_parameters:
+            if (patient_identifier, param_name) in self.derived_values:
+                arrays.append(self.derived_values[(patient_identifier, param_name)])
+            if (patient_identifier, param_name) in self.derived_statistics:
+                param_statistics.append(self.derived_statistics[(patient_identifier, param_name)])
+        for param_statistic in param_statistics:
+            arrays.extend([param_statistic.sorted_values, param_statistic.sketches])
+        return arrays
+
+    # Returns the bytes of parameter values, statistics and cohort aggregates held in memory rather than in
+    # memory-mapped files
+    def get_resident_bytes(self):
+        with self.lock:
+            arrays = [array.values for patient_identifier in self.patient_entries
+                      for array in self.get_patient_arrays(patient_identifier)]
+            arrays.extend(pool for aggregate in self.aggregates for _, pool in aggregate.pools.values())
+            return sum(array.nbytes for array in arrays if not is_file_backed(array))
+
+    # Brings the resident values within the memory budget, if there is one, and returns their size in bytes
+    def enforce_memory_budget(self):
+        if self.memory_budget is None:
+            return self.get_resident_bytes()
+        return self.memory_budget.enforce(self)
+
+    # Names of the exported and derived parameters summarised by default
+    @property
+    def parameter_names(self):
+        return exported_diffusion_parameters + list(self.derived_parameters)
 
-    # Gets diffusion parameter
-    def get_diffusion_parameter(self, param_name, raw):
-        data = raw[param_name]
-        param_frame = pd.DataFrame(data[-1])
-        return param_frame
+    # Defines a derived parameter from an expression over the exported parameters, e.g. 'FA * MD', and returns
+    # its name. Raises ValueError when the expression is invalid or the name is already used.
+    def add_derived_parameter(self, expression, name=None):
+        derived = DerivedParameter(expression, exported_diffusion_parameters, name)
+        with self.lock:
+            if derived.name in exported_diffusion_parameters or derived.name in self.derived_parameters:
+                raise ValueError(f'Diffusion parameter {derived.name} is already defined')
+            self.derived_parameters[derived.name] = derived
+        return derived.name
 
-    # Returns flat list of collective values for a given parameter and specified regions
+    # Returns a patient's values of an exported or derived parameter. Derived parameters are evaluated once per
+    # patient and kept until the patient is removed.
+    def get_parameter_values(self, param_name, patient_identifier):
+        diffusion_parameters = self.patient_entries[patient_identifier]
+        if param_name in diffusion_parameters or param_name not in self.derived_parameters:
+            return diffusion_parameters[param_name]
+        key = (patient_identifier, param_name)
+        values = self.derived_values.get(key)
+        if values is None:
+            values = self.derived_values[key] = self.derived_parameters[param_name].evaluate(diffusion_parameters)
+        return values
+
+    # Returns the per segment statistics of a derived parameter of a patient, computing them once
+    def get_derived_statistics(self, param_name, patient_identifier):
+        key = (patient_identifier, param_name)
+        statistics = self.derived_statistics.get(key)
+        if statistics is None:
+            statistics = self.derived_statistics[key] = get_values_statistics(
+                param_name, self.get_parameter_values(param_name, patient_identifier))
+        return statistics
+
+    # Returns a view of one patient's data held by this registry
+    def get_patient_view(self, patient_identifier):
+        return PatientView(self, patient_identifier)
+
+    # Returns a cohort aggregate holding the given patient regions, updating the closest cached aggregate
+    # when that is cheaper than building a new one
+    def get_aggregate(self, patient_to_regions):
+        selection = {(patient_identifier, region) for patient_identifier, regions in patient_to_regions.items()
+                     for region in regions}
+        aggregate = min(self.aggregates, key=lambda cached: len(cached.selection ^ selection), default=None)
+        if aggregate is None or len(aggregate.selection ^ selection) > len(selection):
+            aggregate = CohortAggregate()
+        else:
+            self.aggregates.remove(aggregate)
+        aggregate.selection = selection
+        self.aggregates.append(aggregate)
+        del self.aggregates[:-max_cached_aggregates]
+        return aggregate
+
+    # Returns the slices of a parameter's value store covering the specified regions
+    def get_parameter_regions_slices(self, param_name, regions, patient_identifier):
+        diffusion_param = self.get_parameter_values(param_name, patient_identifier)
+        return [diffusion_param.values[start:stop] for start, stop in diffusion_param.ranges(regions)]
+
+    # Returns flat array of collective values for a given parameter and specified regions
     def get_parameter_regions_values(self, param_name, regions, patient_identifier):
-        diffusion_param = self.patient_entries[patient_identifier][param_name]
-        values = []
-        for i in regions:
-            values.append(diffusion_param.at[i, 'values'][0].tolist())
-        return __flatten__(values)
+        return concatenate_slices(self.get_parameter_regions_slices(param_name, regions, patient_identifier))
 
-    # Returns a combined list of values for a diffusion parameter given patients and their regions
+    # Returns a combined array of values for a diffusion parameter given patients and their regions
     def get_combined_param_values(self, param_name, patient_to_regions):
-        values = []
+        slices = []
         for patient_identifier, regions in patient_to_regions.items():
-            values.append(self.get_parameter_regions_values(param_name, regions, patient_identifier))
-        return __flatten__(values)
+            slices.extend(self.get_parameter_regions_slices(param_name, regions, patient_identifier))
+        return concatenate_slices(slices)
 
-    # Returns a flat numpy array of diffusion parameter values of a given patients and their regions
+    # Returns a flat numpy array of diffusion parameter values of a given patients and their regions. The
+    # array is a view of the patient's value store when the selection is contiguous, otherwise a single
+    # concatenation
     def get_combined_param_values_array(self, param_name, patient_to_regions):
-        if param_name == 'HA_lg * WALL_THICKNESS / 100':
-            dpv_HA_lg = np.array(self.get_combined_param_values('HA_lg', patient_to_regions))
-            dpv_WALL_THICKNESS = np.array(self.get_combined_param_values('WALL_THICKNESS', patient_to_regions))
-            diffusion_param_values = np.multiply(dpv_HA_lg, dpv_WALL_THICKNESS) / 100
-        else:
-            diffusion_param_values = np.array(self.get_combined_param_values(param_name, patient_to_regions))
-        return diffusion_param_values
+        return self.get_combined_param_values(param_name, patient_to_regions)
 
     # Returns a summary entry for given diffusion parameter for each patient and the selected regions
     def get_combined_param_region_summary(self, param_name, patient_to_regions):
-        diffusion_param_values = self.get_combined_param_values_array(param_name, patient_to_regions)
-
-        if param_name == 'E2A' or param_name == 'TA':
-            diffusion_param_values = np.absolute(diffusion_param_values)
-
-        # Calculate data points
-        param_values_as_series = pd.Series(diffusion_param_values)
-        mean = param_values_as_series.mean()
-        std = param_values_as_series.std()
-        quartiles = st.mstats.mquantiles(diffusion_param_values, [.25, .5, .75], alphap=0.5, betap=0.5)
-        summary = [param_name, mean, std, quartiles[1], quartiles[2] - quartiles[0], quartiles[0], quartiles[2]]
-
-        # Scale if necessary
-        scale_params = ['E1', 'E2', 'E3']
-        if param_name in scale_params:
-            for i in range(1, len(summary)):
-                summary[i] = summary[i] * 1000
+        return self.get_combined_patient_regions_summary(patient_to_regions, [param_name]).iloc[0].tolist()
+
+    # Returns the stacked per segment counts, totals and centred sums of squares of a patient's parameters,
+    # with shape (3, parameters, regions). Parameters the patient does not have contribute nothing.
+    def get_patient_moments(self, patient_identifier, param_names):
+        cached = self.patient_moments.get(patient_identifier)
+        if cached is not None and cached[0] == param_names:
+            return cached[1]
+        statistics = self.patient_statistics[patient_identifier]
+        moments = np.zeros((3, len(param_names), region_count))
+        for i, param_name in enumerate(param_names):
+            if param_name in statistics:
+                param_statistics = statistics[param_name]
+                moments[:, i] = param_statistics.counts, param_statistics.totals, param_statistics.squares
+        self.patient_moments[patient_identifier] = (param_names, moments)
+        return moments
+
+    # Returns the moments of the given parameters for every selected (patient, region) pair, with shape
+    # (3, parameters, pairs)
+    def get_selection_moments(self, param_names, selection):
+        moments = [self.get_patient_moments(patient_identifier, param_names)[:, :, regions]
+                   for patient_identifier, regions in get_selection_regions(selection).items()]
+        if not moments:
+            return np.zeros((3, len(param_names), 0))
+        return np.concatenate(moments, axis=2)
+
+    # Returns a summary panda data frame for all diffusion parameters, or only the given ones, in the given
+    # dictionary of patient identifiers to regions
+    @instrumented('get_combined_patient_regions_summary')
+    def get_combined_patient_regions_summary(self, patient_to_regions, parameters=None):
+        param_names = tuple(parameters or self.parameter_names)
+        with self.lock:
+            aggregate = self.get_aggregate(patient_to_regions)
+            counts, totals, squares = self.get_selection_moments(param_names, aggregate.selection)
+            if self.quantile_mode == approximate_quantile_mode:
+                quartiles = approximate_quartiles_batch([self.get_selection_sketches(param_name, aggregate.selection)
+                                                         for param_name in param_names])
+            else:
+                quartiles = exact_quartiles_batch([aggregate.sorted_values(param_name, self.patient_statistics)
+                                                   for param_name in param_names])
+            resampler = self.resampler
+            if resampler is not None:
+                clustered_values = [self.get_selection_clusters(param_name, aggregate.selection)
+                                    for param_name in param_names]
+        scales = [1000 if param_name in scale_parameters else 1 for param_name in param_names]
+        summary = summarise_parameters(param_names, counts, totals, squares, quartiles, scales)
+        if resampler is not None:
+            add_interval_columns(summary, resampler.bootstrap_intervals(param_names, clustered_values),
+                                 resampler.confidence_level, scales)
         return summary
 
-    # Returns a summary panda data frame for all diffusion parameters in the given dictionary of
-    # patient identifiers to regions
-    def get_combined_patient_regions_summary(self, patient_to_regions):
-        columns = ['Diffusion Parameter', 'Mean', 'Standard Deviation', 'Median', 'Interquartile Range',
-                   'Lower Quartile', 'Upper Quartile']
-        data = []
-        for parameter in supported_diffusion_parameters:
-            parameter_summary = self.get_combined_param_region_summary(parameter, patient_to_regions)
-            data.append(parameter_summary)
-        return pd.DataFrame(data, columns=columns)
+    # Returns the sorted values of a parameter over the selected (patient, region) pairs clustered by patient, or
+    # by segment when only one patient is selected, for resampling
+    def get_selection_clusters(self, param_name, selection):
+        patient_to_regions = get_selection_regions(selection)
+        clusters = []
+        for patient_identifier, regions in patient_to_regions.items():
+            statistics = self.patient_statistics[patient_identifier]
+            if param_name not in statistics:
+                continue
+            sorted_values = statistics[param_name].sorted_values
+            if len(patient_to_regions) == 1:
+                clusters.extend(sorted_values.segment(region) for region in regions)
+            else:
+                clusters.append(sorted_values.select(regions))
+        return ClusteredValues(clusters)
+
+    # Compares two dictionaries of patient identifiers to regions for all diffusion parameters, or only the given
+    # ones, with permutation tests that relabel whole patients (or segments when only one patient is selected).
+    # Returns a panda data frame of the median differences (B - A) and Mann-Whitney statistics with p-values.
+    @instrumented('get_selection_comparison')
+    def get_selection_comparison(self, patient_to_regions_a, patient_to_regions_b, parameters=None):
+        param_names = tuple(parameters or self.parameter_names)
+        with self.lock:
+            resampler = self.resampler or Resampler()
+            comparisons = [self.get_comparison_clusters(param_name, patient_to_regions_a, patient_to_regions_b)
+                           for param_name in param_names]
+        scales = [1000 if param_name in scale_parameters else 1 for param_name in param_names]
+        return summarise_comparisons(param_names, resampler.compare(param_names, comparisons), scales)
+
+    # Returns the sorted values of a parameter in two selections as clusters to compare
+    def get_comparison_clusters(self, param_name, patient_to_regions_a, patient_to_regions_b):
+        selections = [{patient_identifier: sorted(regions) for patient_identifier, regions in selection.items()
+                       if len(regions)} for selection in (patient_to_regions_a, patient_to_regions_b)]
+        by_segment = len(set(selections[0]) | set(selections[1])) == 1
+        clusters, in_b, units = [], [], []
+        for side, selection in enumerate(selections):
+            for patient_identifier, regions in selection.items():
+                statistics = self.patient_statistics[patient_identifier]
+                if param_name not in statistics:
+                    continue
+                sorted_values = statistics[param_name].sorted_values
+                if by_segment:
+                    clusters.extend(sorted_values.segment(region) for region in regions)
+                    units.extend(regions)
+                    in_b.extend([side] * len(regions))
+                else:
+                    clusters.append(sorted_values.select(regions))
+                    units.append(patient_identifier)
+                    in_b.append(side)
+        return ClusteredComparison(clusters, in_b, units)
+
+    # Returns the merged sketch points of a parameter over the selected (patient, region) pairs and the number
+    # of values each point stands for
+    def get_selection_sketches(self, param_name, selection):
+        points, weights = [], []
+        for patient_identifier, regions in get_selection_regions(selection).items():
+            statistics = self.patient_statistics[patient_identifier]
+            if param_name not in statistics:
+                continue
+            sketches = statistics[param_name].sketches
+            lengths = sketches.lengths[regions]
+            counts = statistics[param_name].sorted_values.lengths[regions]
+            points.append(sketches.select(regions))
+            weights.append(np.repeat(counts / np.maximum(lengths, 1), lengths))
+        if not points:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(points), np.concatenate(weights)
 
     # Returns a summary panda data frame for all diffusion parameters in the given dictionary of
     # all patient identifiers
@@ -99,9 +412,98 @@ class DiffusionParameterData:
 
     # Returns a summary panda data frame for all diffusion parameters in the given regions of the given patient
     def get_regions_summary(self, regions, patient_identifier):
+        self.touch_patient(patient_identifier)
         return self.get_combined_patient_regions_summary({patient_identifier: regions})
 
+    # Returns the statistics of every segment of every patient computed in one pass, as (patient identifiers,
+    # parameter names, statistics) where statistics has shape (patients, regions, parameters, statistics) and
+    # is ordered as segment_statistic_columns. Segments without values are NaN.
+    @instrumented('get_segment_statistics')
+    def get_segment_statistics(self, parameters=None):
+        param_names = tuple(parameters or self.parameter_names)
+        empty = SegmentedArray(np.empty(0, dtype=np.float64), np.zeros(region_count + 1, dtype=np.int64))
+        with self.lock:
+            patient_identifiers = list(self.patient_entries)
+            moments = np.stack([self.get_patient_moments(patient_identifier, param_names)
+                                for patient_identifier in patient_identifiers], axis=1) \
+                if patient_identifiers else np.zeros((3, 0, len(param_names), region_count))
+            sorted_values = [self.patient_statistics[patient_identifier][param_name].sorted_values
+                             if param_name in self.patient_statistics[patient_identifier] else empty
+                             for patient_identifier in patient_identifiers for param_name in param_names]
+        quartiles = segment_quartiles_batch(sorted_values, region_count)
+        quartiles = quartiles.reshape(len(patient_identifiers), len(param_names), *quartiles.shape[1:])
+        scales = [1000 if param_name in scale_parameters else 1 for param_name in param_names]
+        return patient_identifiers, list(param_names), summarise_segments(*moments, quartiles, scales)
+
+    # Returns the statistics of every segment of every patient as a panda data frame with one row per patient,
+    # 1-based segment and diffusion parameter
+    def get_segment_statistics_frame(self, parameters=None):
+        return get_segment_statistics_frame(self.get_segment_statistics(parameters))
+
     # Removes patient data
     def remove_patient_data(self, patient_identifier):
-        self.patient_entries.pop(patient_identifier)
-        self.patient_global.pop(patient_identifier)
+        with self.lock:
+            self.remove_patient_contribution(patient_identifier)
+            self.patient_statistics.pop(patient_identifier)
+            self.patient_entries.pop(patient_identifier)
+            self.patient_global.pop(patient_identifier)
+            if self.memory_budget is not None:
+                self.memory_budget.forget(patient_identifier)
+
+    # Removes a patient's values from the cached cohort aggregates and forgets its cached moments and derived
+    # parameters
+    def remove_patient_contribution(self, patient_identifier):
+        for aggregate in self.aggregates:
+            aggregate.remove_patient(patient_identifier, self.patient_statistics)
+        self.patient_moments.pop(patient_identifier, None)
+        for param_name in self.derived_parameters:
+            self.derived_values.pop((patient_identifier, param_name), None)
+            self.derived_statistics.pop((patient_identifier, param_name), None)
+
+
+# Per patient view of a DiffusionParameterData registry. It references the registry's arrays and cached
+# statistics rather than copying them.
+class PatientView:
+    def __init__(self, registry, patient_identifier):
+        self.registry = registry
+        self.patient_identifier = patient_identifier
+
+    # Returns a summary panda data frame for all diffusion parameters in all regions of the patient
+    def get_global_summary(self):
+        return self.registry.get_regions_summary(self.registry.patient_global[self.patient_identifier],
+                                                 self.patient_identifier)
+
+    # Returns a summary panda data frame for all diffusion parameters in the given regions of the patient
+    def get_regions_summary(self, regions):
+        return self.registry.get_regions_summary(regions, self.patient_identifier)
+
+
+# Statistics of one patient in a registry: those computed when the patient was added, followed by the
+# registry's derived parameters that the patient has the source parameters for
+class PatientStatisticsView(Mapping):
+    def __init__(self, registry, patient_identifier, statistics):
+        self.registry = registry
+        self.patient_identifier = patient_identifier
+        self.statistics = statistics
+
+    def __getitem__(self, param_name):
+        if param_name in self.statistics:
+            return self.statistics[param_name]
+        if param_name not in self:
+            raise KeyError(param_name)
+        return self.registry.get_derived_statistics(param_name, self.patient_identifier)
+
+    def __contains__(self, param_name):
+        if param_name in self.statistics:
+            return True
+        derived = self.registry.derived_parameters.get(param_name)
+        return derived is not None and derived.is_available(self.registry.patient_entries[self.patient_identifier])
+
+    def __iter__(self):
+        yield from self.statistics
+        for param_name in self.registry.derived_parameters:
+            if param_name not in self.statistics and param_name in self:
+                yield param_name
+
+    def __len__(self):
+        return sum(1 for _ in self)
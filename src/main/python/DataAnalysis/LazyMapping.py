@@ -0,0 +1,30 @@
+from collections.abc import Mapping
+
+
+# Read-only mapping over a known set of keys whose values are created by a factory the first time they are
+# accessed and kept afterwards. Membership and iteration never create values.
+class LazyMapping(Mapping):
+    def __init__(self, keys, factory):
+        self._keys = dict.fromkeys(keys)
+        self._factory = factory
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._keys:
+                raise KeyError(key)
+            self._values[key] = self._factory(key)
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    # Returns the keys whose values have been created
+    def materialized(self):
+        return [key for key in self._keys if key in self._values]
@@ -0,0 +1,139 @@
+import mmap
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from DataAnalysis.Profiler import instrumented
+
+# Memory budget, in megabytes, applied when the DTCMR_MEMORY_BUDGET_MB environment variable is set
+memory_budget_environment_variable = 'DTCMR_MEMORY_BUDGET_MB'
+float32_info = np.finfo(np.float32)
+
+
+# Returns whether an array's memory belongs to a mapped file rather than the process heap
+def is_file_backed(array):
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None) if isinstance(array, np.ndarray) else getattr(array, 'obj', None)
+    return False
+
+
+# Returns whether float64 values can be stored as float32 without leaving its normal range, so that each
+# value keeps a relative error below 2 ** -24
+def fits_float32(values):
+    magnitudes = np.abs(values[np.isfinite(values)])
+    return not len(magnitudes) or (magnitudes.max() <= float32_info.max and
+                                    magnitudes[magnitudes > 0].min(initial=np.inf) >= float32_info.tiny)
+
+
+# Keeps a registry's resident parameter values within a size limit. Values are stored as float32 where they
+# fit, then cached cohort aggregates are dropped, and then the arrays of the least recently viewed patients are
+# moved to a spill file that is memory-mapped, so the operating system pages them back in when a summary reads
+# them. The arrays spilled together share one file and mapping, which is unlinked once mapped where the
+# platform allows. Statistics are still accumulated in float64.
+class MemoryBudget:
+    # Spilled arrays start at multiples of this many bytes
+    alignment = 64
+
+    def __init__(self, limit_bytes, directory=None):
+        self.limit_bytes = limit_bytes
+        self.directory = directory
+        self._owns_directory = directory is None
+        # Patient identifiers, least recently viewed first
+        self.recent = OrderedDict()
+
+    # Returns a budget from the DTCMR_MEMORY_BUDGET_MB environment variable, or None when it is not set
+    @classmethod
+    def from_environment(cls):
+        try:
+            megabytes = float(os.environ.get(memory_budget_environment_variable, ''))
+        except ValueError:
+            return None
+        return cls(int(megabytes * 1024 ** 2)) if megabytes > 0 else None
+
+    # Marks a patient as the most recently viewed
+    def touch(self, patient_identifier):
+        self.recent.pop(patient_identifier, None)
+        self.recent[patient_identifier] = None
+
+    # Forgets a removed patient
+    def forget(self, patient_identifier):
+        self.recent.pop(patient_identifier, None)
+
+    # Brings a registry within the budget and returns its resident size in bytes
+    @instrumented('memory budget', 'load')
+    def enforce(self, registry):
+        with registry.lock:
+            for patient_identifier in registry.patient_entries:
+                if patient_identifier not in self.recent:
+                    self.touch(patient_identifier)
+                for array in registry.get_patient_arrays(patient_identifier):
+                    self.compact(array)
+            # Pools hold the same values as the patients' compacted sorted values, so a pool that cannot be stored
+            # as float32 is dropped and rebuilt from them when next needed
+            for aggregate in registry.aggregates:
+                for param_name, (selection, pool) in list(aggregate.pools.items()):
+                    if pool.dtype != np.float64:
+                        continue
+                    if fits_float32(pool):
+                        aggregate.pools[param_name] = (selection, pool.astype(np.float32))
+                    else:
+                        del aggregate.pools[param_name]
+            resident = registry.get_resident_bytes()
+            # Older aggregates go first, and the latest too when its pools alone exceed the budget
+            if resident > self.limit_bytes and registry.aggregates:
+                del registry.aggregates[:-1]
+                if sum(pool.nbytes for _, pool in registry.aggregates[0].pools.values()) > self.limit_bytes:
+                    del registry.aggregates[:]
+                resident = registry.get_resident_bytes()
+            spilled = []
+            for patient_identifier in self.recent:
+                if resident <= self.limit_bytes:
+                    break
+                if patient_identifier in registry.patient_entries:
+                    arrays = [array for array in registry.get_patient_arrays(patient_identifier)
+                              if not is_file_backed(array.values) and array.values.nbytes]
+                    spilled.extend(arrays)
+                    resident -= sum(array.values.nbytes for array in arrays)
+            self.spill(spilled)
+            return resident
+
+    # Stores a resident float64 value array as float32 when it fits
+    @staticmethod
+    def compact(array):
+        if array.values.dtype == np.float64 and not is_file_backed(array.values) and fits_float32(array.values):
+            array.values = array.values.astype(np.float32)
+
+    # Writes arrays to one spill file and replaces their values by views of its mapping
+    def spill(self, arrays):
+        if not arrays:
+            return
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='dtcmr-spill-')
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, path = tempfile.mkstemp(dir=self.directory, suffix='.spill')
+        offsets = []
+        with os.fdopen(descriptor, 'wb') as file:
+            for array in arrays:
+                file.write(bytes(-file.tell() % self.alignment))
+                offsets.append(file.tell())
+                file.write(np.ascontiguousarray(array.values).tobytes())
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        for array, offset in zip(arrays, offsets):
+            array.values = np.frombuffer(mapped, dtype=array.values.dtype, count=len(array.values), offset=offset)
+        try:
+            os.remove(path)
+        except OSError:
+            # Mapped files cannot be removed on Windows; they are removed with the spill directory
+            pass
+
+    # Deletes the spill directory when the budget created it
+    def close(self):
+        if self._owns_directory and self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
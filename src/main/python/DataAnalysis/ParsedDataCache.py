@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from DataAnalysis.Profiler import instrumented
+from DataAnalysis.SegmentStatistics import SegmentStatistics
+from DataAnalysis.SegmentedArray import SegmentedArray
+
+# Cache location, overridable with the DTCMR_CACHE_DIR environment variable
+default_cache_directory = os.environ.get('DTCMR_CACHE_DIR') or os.path.join(
+    os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                                                       '.cache'),
+    'dt-cmr-rat')
+default_size_limit = 2 * 1024 ** 3
+manifest_name = 'manifest.json'
+cache_version = 2
+
+
+# On-disk cache of parsed diffusion parameters and their segment statistics. Each source file gets an entry
+# directory of .npy files that are memory-mapped on a hit, so loadmat is skipped entirely. An entry is
+# invalid once its source's size or modification time changes, and the least recently used entries are
+# evicted when the cache grows beyond its size limit.
+class ParsedDataCache:
+    def __init__(self, directory=default_cache_directory, size_limit=default_size_limit):
+        self.directory = directory
+        self.size_limit = size_limit
+
+    # Returns the entry directory of a source file
+    def entry_directory(self, source_path):
+        key = hashlib.sha1(os.path.abspath(source_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key)
+
+    # Returns the identity of a source file that a cache entry must match
+    @staticmethod
+    def source_stamp(source_path):
+        stat = os.stat(source_path)
+        return {'version': cache_version, 'source': os.path.abspath(source_path), 'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns}
+
+    # Returns (diffusion parameters, statistics) for a source file, or None on a miss. Every array is
+    # memory-mapped rather than read.
+    @instrumented('cache load', 'load')
+    def load(self, source_path):
+        entry = self.entry_directory(source_path)
+        manifest_path = os.path.join(entry, manifest_name)
+        try:
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            if manifest['stamp'] != self.source_stamp(source_path):
+                return None
+            os.utime(manifest_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        parameters = {param_name: (i, offsets) for i, (param_name, offsets) in enumerate(manifest['parameters'])}
+        statistics = {param_name: (i, offsets, sketch_offsets)
+                      for i, (param_name, offsets, sketch_offsets) in enumerate(manifest['statistics'])}
+        # Every array is mapped now, so the patient keeps its data if the entry is later evicted
+        try:
+            return {param_name: self.read_parameter(entry, parameters, param_name) for param_name in parameters}, \
+                {param_name: self.read_statistics(entry, statistics, param_name) for param_name in statistics}
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def read_array(entry, name, offsets):
+        return SegmentedArray(np.load(os.path.join(entry, f'{name}.npy'), mmap_mode='r'),
+                              np.asarray(offsets, dtype=np.int64))
+
+    @classmethod
+    def read_parameter(cls, entry, parameters, param_name):
+        i, offsets = parameters[param_name]
+        return cls.read_array(entry, f'values_{i}', offsets)
+
+    @classmethod
+    def read_statistics(cls, entry, statistics, param_name):
+        i, offsets, sketch_offsets = statistics[param_name]
+        moments = np.load(os.path.join(entry, f'moments_{i}.npy'))
+        return SegmentStatistics(moments[0].astype(np.int64), moments[1], moments[2],
+                                 cls.read_array(entry, f'sorted_{i}', offsets),
+                                 cls.read_array(entry, f'sketch_{i}', sketch_offsets))
+
+    # Stores parsed diffusion parameters and statistics of a source file, then enforces the size limit
+    @instrumented('cache store', 'load')
+    def store(self, source_path, diffusion_parameters, statistics):
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self.entry_directory(source_path)
+        staging = tempfile.mkdtemp(dir=self.directory, prefix='.staging-')
+        try:
+            manifest = {'stamp': self.source_stamp(source_path), 'parameters': [], 'statistics': []}
+            for i, (param_name, values) in enumerate(diffusion_parameters.items()):
+                np.save(os.path.join(staging, f'values_{i}.npy'), np.ascontiguousarray(values.values))
+                manifest['parameters'].append([param_name, values.offsets.tolist()])
+            for i, (param_name, param_statistics) in enumerate(statistics.items()):
+                np.save(os.path.join(staging, f'sorted_{i}.npy'),
+                        np.ascontiguousarray(param_statistics.sorted_values.values))
+                np.save(os.path.join(staging, f'sketch_{i}.npy'),
+                        np.ascontiguousarray(param_statistics.sketches.values))
+                np.save(os.path.join(staging, f'moments_{i}.npy'),
+                        np.stack([param_statistics.counts, param_statistics.totals, param_statistics.squares]))
+                manifest['statistics'].append([param_name, param_statistics.sorted_values.offsets.tolist(),
+                                               param_statistics.sketches.offsets.tolist()])
+            with open(os.path.join(staging, manifest_name), 'w') as file:
+                json.dump(manifest, file)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.evict()
+
+    # Removes least recently used entries until the cache fits within its size limit
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, file_name)) for file_name in os.listdir(entry))
+                entries.append((os.path.getmtime(os.path.join(entry, manifest_name)), size, entry))
+            except OSError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.size_limit:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    # Removes every cache entry
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,97 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from DataAnalysis import DiffusionParameterData as dpd
+from DataAnalysis.Profiler import profiler
+from DataAnalysis.SegmentedArray import SegmentedArray
+
+# Patient parsed from its exported diffusion parameters, small enough to be returned from worker processes
+LoadedPatient = namedtuple('LoadedPatient', ['identifier', 'directory', 'diffusion_parameters', 'statistics'])
+
+
+# Returns the exported diffusion parameters file of a patient data directory
+def get_diffusion_parameters_file(patient_data_directory):
+    return os.path.join(patient_data_directory, 'result_images', 'exported_data', 'diffusion_parameters.mat')
+
+
+# Returns the patient identifier of a patient data directory
+def get_patient_identifier(patient_data_directory):
+    return os.path.basename(os.path.normpath(patient_data_directory))
+
+
+# Returns whether a .mat file is a v7.3 export, which is stored as HDF5
+def is_hdf5_mat_file(dp_file_path):
+    with open(dp_file_path, 'rb') as file:
+        header = file.read(128)
+    return len(header) == 128 and header[124:126] in (b'\x00\x02', b'\x02\x00')
+
+
+# Opens a v7.3 export with h5py, which is only needed for those files
+def open_hdf5_mat_file(dp_file_path):
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError(f'{dp_file_path} is a MATLAB v7.3 file and h5py is required to read it')
+    return h5py.File(dp_file_path, 'r')
+
+
+# Reads a parameter's struct array from a v7.3 export, following each segment's object reference
+def read_hdf5_parameter(file, param_name):
+    references = file[param_name + dpd.column_ending]['values'][()]
+    if references.ndim == 2:
+        # MATLAB arrays are stored transposed, so the last MATLAB row is the last column
+        references = references[:, -1]
+    return SegmentedArray.from_segments(read_hdf5_segment(file[reference]) for reference in references)
+
+
+# Reads a segment's values. MATLAB stores an empty array as a dataset of its dimensions flagged with a
+# MATLAB_empty attribute, so such a segment has no values.
+def read_hdf5_segment(dataset):
+    if dataset.attrs.get('MATLAB_empty', 0):
+        return np.empty(0, dtype=np.float64)
+    return np.ravel(dataset[()])
+
+
+# Reads only the given supported parameters (all of them by default) from a .mat file, skipping the
+# image volumes and other variables it also contains
+def read_exported_parameters(dp_file_path, param_names=None):
+    param_names = dpd.exported_diffusion_parameters if param_names is None else param_names
+    if is_hdf5_mat_file(dp_file_path):
+        with profiler.span('h5py read', 'load'), open_hdf5_mat_file(dp_file_path) as file:
+            return {param_name: read_hdf5_parameter(file, param_name) for param_name in param_names
+                    if param_name + dpd.column_ending in file}
+    from scipy.io import loadmat
+    with profiler.span('loadmat', 'load'):
+        data = loadmat(dp_file_path, variable_names=[param_name + dpd.column_ending for param_name in param_names])
+    with profiler.span('parse', 'load'):
+        return dpd.parse_diffusion_parameters(data)
+
+
+# Loads, parses and caches the statistics of a patient's diffusion parameters, using the parsed data cache
+# when one is given
+def load_patient(patient_data_directory, cache=None):
+    patient = load_cached_patient(patient_data_directory, cache) if cache is not None else None
+    if patient is not None:
+        return patient
+    dp_file_path = get_diffusion_parameters_file(patient_data_directory)
+    if not os.path.exists(dp_file_path):
+        raise FileNotFoundError(f'File path error: {patient_data_directory} does not contain diffusion parameters')
+    diffusion_parameters = read_exported_parameters(dp_file_path)
+    statistics = dpd.get_patient_statistics(diffusion_parameters)
+    if cache is not None:
+        cache.store(dp_file_path, diffusion_parameters, statistics)
+    return LoadedPatient(get_patient_identifier(patient_data_directory), patient_data_directory,
+                         diffusion_parameters, statistics)
+
+
+# Returns a patient memory-mapped from the parsed data cache, or None when it has not been cached
+def load_cached_patient(patient_data_directory, cache):
+    dp_file_path = get_diffusion_parameters_file(patient_data_directory)
+    if not os.path.exists(dp_file_path):
+        return None
+    cached = cache.load(dp_file_path)
+    if cached is None:
+        return None
+    return LoadedPatient(get_patient_identifier(patient_data_directory), patient_data_directory, *cached)
@@ -0,0 +1,77 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+from PyQt5 import QtCore
+
+from DataAnalysis.PatientFiles import load_cached_patient, load_patient
+from DataAnalysis.Profiler import profiled_call, profiler
+
+
+# Parses patient directories in a process pool off the GUI thread. Parsed patients, failures and progress
+# are delivered through signals, which Qt queues onto the receiving thread. Patients found in the parsed data
+# cache are memory-mapped on this thread rather than copied back from a worker process. While profiling,
+# the events recorded in the workers are returned with each patient and added to this process's profiler.
+class PatientLoader(QtCore.QThread):
+    patient_loaded = QtCore.pyqtSignal(object)
+    load_failed = QtCore.pyqtSignal(str, str)
+    progress = QtCore.pyqtSignal(int, int)
+
+    # Interval at which a running load checks for cancellation
+    poll_interval = 0.1
+
+    def __init__(self, patient_data_directories, cache=None, max_workers=None, parent=None):
+        super(PatientLoader, self).__init__(parent)
+        self.patient_data_directories = list(patient_data_directories)
+        self.cache = cache
+        self.max_workers = max_workers
+        self._cancelled = False
+
+    # Requests cancellation; patients that are already being parsed finish but are not delivered
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def run(self):
+        total = len(self.patient_data_directories)
+        completed = 0
+        self.progress.emit(completed, total)
+        uncached = []
+        for directory in self.patient_data_directories:
+            patient = load_cached_patient(directory, self.cache) if self.cache is not None else None
+            if self._cancelled:
+                return
+            if patient is None:
+                uncached.append(directory)
+                continue
+            self.patient_loaded.emit(patient)
+            completed += 1
+            self.progress.emit(completed, total)
+        if not uncached:
+            return
+
+        profiling = profiler.enabled
+        load = partial(load_patient, cache=self.cache)
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(partial(profiled_call, load) if profiling else load, directory): directory
+                       for directory in uncached}
+            while pending and not self._cancelled:
+                done, _ = wait(pending, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory = pending.pop(future)
+                    if self._cancelled:
+                        break
+                    try:
+                        patient = future.result()
+                    except Exception as error:
+                        self.load_failed.emit(directory, str(error))
+                    else:
+                        if profiling:
+                            patient, events = patient
+                            profiler.add_events(events)
+                        self.patient_loaded.emit(patient)
+                    completed += 1
+                    self.progress.emit(completed, total)
+            for future in pending:
+                future.cancel()
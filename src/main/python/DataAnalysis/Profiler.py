@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+# Opt-in instrumentation of the loading and summary stages, enabled by setting DTCMR_PROFILE=1 or with the
+# viewer's Profile toggle. Each instrumented call records its wall time, thread and traced memory delta as a
+# Chrome trace event, which can be exported and opened in chrome://tracing or Perfetto. When disabled an
+# instrumented call costs one attribute check.
+profile_environment_variable = 'DTCMR_PROFILE'
+
+
+class Profiler:
+    def __init__(self, enabled=False):
+        self.enabled = False
+        self.events = []
+        self.last_event = None
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+        if enabled:
+            self.enable()
+
+    # Starts recording, tracing memory allocations unless something else already does
+    def enable(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.enabled = True
+
+    # Stops recording, keeping the events recorded so far
+    def disable(self):
+        self.enabled = False
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    # Discards every recorded event
+    def clear(self):
+        with self._lock:
+            self.events = []
+            self.last_event = None
+
+    # Returns and discards every recorded event
+    def take_events(self):
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    # Adds events recorded elsewhere, e.g. in a worker process
+    def add_events(self, events):
+        with self._lock:
+            self.events.extend(events)
+            if events:
+                self.last_event = events[-1]
+
+    # Records the block as one event when enabled
+    @contextmanager
+    def span(self, name, category='summary'):
+        if not self.enabled:
+            yield
+            return
+        memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter_ns() - start
+            event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start / 1000, 'dur': duration / 1000,
+                     'pid': os.getpid(), 'tid': threading.get_ident(),
+                     'args': {'memory_delta_bytes': tracemalloc.get_traced_memory()[0] - memory}}
+            with self._lock:
+                self.events.append(event)
+                self.last_event = event
+
+    # Returns the call count, total and longest wall time in seconds and total memory delta of each stage
+    def statistics(self):
+        statistics = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            stage = statistics.setdefault(event['name'], {'calls': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                                                          'memory_delta_bytes': 0})
+            stage['calls'] += 1
+            stage['total_seconds'] += event['dur'] / 1e6
+            stage['max_seconds'] = max(stage['max_seconds'], event['dur'] / 1e6)
+            stage['memory_delta_bytes'] += event['args']['memory_delta_bytes']
+        return statistics
+
+    # Writes the recorded events in Chrome trace format, with the per stage statistics as metadata
+    def export_chrome_trace(self, path):
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'statistics': self.statistics()}}, file)
+
+
+profiler = Profiler(os.environ.get(profile_environment_variable, '') not in ('', '0'))
+
+
+# Records every call of the decorated function under the given stage name while profiling is enabled
+def instrumented(name, category='summary'):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.span(name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Calls function with profiling enabled and returns its result with the events it recorded, so that work
+# done in a worker process can be added to the parent's profiler
+def profiled_call(function, *args):
+    enabled = profiler.enabled
+    profiler.enable()
+    try:
+        return function(*args), profiler.take_events()
+    finally:
+        if not enabled:
+            profiler.disable()
@@ -0,0 +1,34 @@
+import numpy as np
+
+# Mergeable quantile sketches. A segment of n sorted values is summarised by sketch_size values taken at
+# evenly spaced ranks, each standing for n / sketch_size of the original values; segments with at most
+# sketch_size values are kept whole. Merging sketches is a weighted union of their points, and because each
+# point misplaces at most half of the values it stands for, the estimated rank of any value is within
+# n / (2 * sketch_size) of its true rank for every segment. Summed over a selection, a quantile at
+# probability p therefore has a true probability within p +/- rank_error.
+sketch_size = 128
+rank_error = 1 / (2 * sketch_size)
+
+
+# Builds the sketch of one sorted segment
+def build_sketch(sorted_values, size=sketch_size):
+    n = len(sorted_values)
+    if n <= size:
+        return np.array(sorted_values, dtype=np.float64)
+    ranks = (np.arange(size) + 0.5) * n / size - 0.5
+    return np.interp(ranks, np.arange(n), sorted_values)
+
+
+# Quantiles of merged sketch points with the given weights, using the same plotting positions as scipy's
+# mquantiles. With unit weights (only whole segments) the result equals the exact quantiles.
+def sketch_quantiles(values, weights, probabilities, alphap=0.5, betap=0.5):
+    probabilities = np.atleast_1d(np.asarray(probabilities, dtype=np.float64))
+    if len(values) == 0:
+        return np.full(len(probabilities), np.nan)
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    n = weights.sum()
+    # 1-based rank of the centre of the values each point stands for
+    centres = np.cumsum(weights) - weights / 2 + 0.5
+    aleph = n * probabilities + (alphap + probabilities * (1. - alphap - betap))
+    return np.interp(aleph, centres, values)
@@ -0,0 +1,231 @@
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Bootstrap confidence intervals and permutation tests that resample whole clusters (patients, or the segments
+# of a single patient) rather than individual voxels, whose values are correlated within a patient. Every
+# resample is a vector of integer weights per cluster applied to the pooled values, which are sorted only once,
+# so a batch of resamples is summarised with a few array operations. Each parameter's resamples are drawn in
+# fixed size chunks from seeds derived from the resampler's seed and the parameter name, so results are
+# reproducible and do not depend on how many processes share the work.
+default_replicates = 1000
+default_permutations = 1000
+default_confidence_level = 0.95
+chunk_size = 250
+# The pooled values are split into blocks of at least this many values, and at most max_rank_blocks blocks,
+# when locating ranks
+min_block_size = 64
+max_rank_blocks = 4096
+
+
+# Pooled sorted values of several clusters with the cluster each value came from. NaN values are kept at the
+# end, as in the sorted values quartiles are computed from.
+class ClusteredValues:
+    def __init__(self, clusters):
+        self.cluster_sizes = np.array([len(cluster) for cluster in clusters], dtype=np.float64)
+        values = np.concatenate(clusters) if clusters else np.empty(0, dtype=np.float64)
+        labels = np.repeat(np.arange(len(clusters)), self.cluster_sizes.astype(np.int64))
+        order = np.argsort(values, kind='stable')
+        self.values = values[order]
+        self.labels = labels[order]
+        # Number of each cluster's values before each block boundary, with shape (clusters, blocks + 1)
+        block_count = int(np.clip(len(values) // min_block_size, 1, max_rank_blocks))
+        self.boundaries = np.linspace(0, len(values), block_count + 1).astype(np.int64)
+        blocks = np.repeat(np.arange(block_count), np.diff(self.boundaries))
+        counts = np.bincount(self.labels * block_count + blocks, minlength=len(clusters) * block_count)
+        self.cumulative_counts = np.zeros((len(clusters), block_count + 1))
+        np.cumsum(counts.reshape(len(clusters), block_count), axis=1, out=self.cumulative_counts[:, 1:])
+
+    @property
+    def cluster_count(self):
+        return len(self.cluster_sizes)
+
+    # Returns the values at 1-based ranks of weighted resamples. weights has shape (resamples, clusters) and
+    # ranks (resamples, ranks); each rank must lie within its resample's total weight.
+    def values_at_ranks(self, weights, ranks):
+        cumulative = weights @ self.cumulative_counts
+        rows = np.arange(len(weights))[:, np.newaxis]
+        block_size = int(np.diff(self.boundaries).max())
+        last = len(self.values) - 1
+        values = np.empty(ranks.shape)
+        for i in range(ranks.shape[1]):
+            rank = ranks[:, i, np.newaxis]
+            # The block holding each rank is the last whose preceding values weigh less than the rank
+            block = np.clip((cumulative < rank).sum(axis=1) - 1, 0, len(self.boundaries) - 2)
+            start = self.boundaries[block]
+            positions = start[:, np.newaxis] + np.arange(block_size)
+            in_block = positions < self.boundaries[block + 1][:, np.newaxis]
+            element_weights = np.where(in_block, weights[rows, self.labels[np.minimum(positions, last)]], 0)
+            running = cumulative[rows[:, 0], block][:, np.newaxis] + np.cumsum(element_weights, axis=1)
+            values[:, i] = self.values[np.minimum(start + (running < rank).sum(axis=1), last)]
+        return values
+
+    # Quantiles of weighted resamples, using the same plotting positions as scipy's mquantiles. Returns an
+    # array of shape (resamples, probabilities) that is NaN for empty resamples.
+    def weighted_quantiles(self, weights, probabilities, alphap=0.5, betap=0.5):
+        probabilities = np.atleast_1d(np.asarray(probabilities, dtype=np.float64))
+        n = (weights @ self.cluster_sizes)[:, np.newaxis]
+        if len(self.values) == 0:
+            return np.full((len(weights), len(probabilities)), np.nan)
+        aleph = n * probabilities + (alphap + probabilities * (1. - alphap - betap))
+        k = np.floor(aleph.clip(1, np.maximum(n - 1, 1)))
+        gamma = (aleph - k).clip(0, 1)
+        upper_rank = np.minimum(k + 1, np.maximum(n, 1))
+        ranks = self.values_at_ranks(weights, np.concatenate([np.minimum(k, np.maximum(n, 1)), upper_rank], axis=1))
+        lower, upper = ranks[:, :len(probabilities)], ranks[:, len(probabilities):]
+        return np.where(n > 1, (1. - gamma) * lower + gamma * upper, np.where(n == 1, lower, np.nan))
+
+    # Returns the sum of the midranks of each cluster's non-NaN values among all non-NaN values, and the
+    # number of non-NaN values of each cluster
+    def rank_sums(self):
+        valid = ~np.isnan(self.values)
+        _, inverse, ties = np.unique(self.values[valid], return_inverse=True, return_counts=True)
+        midranks = (np.cumsum(ties) - (ties - 1) / 2)[inverse]
+        labels = self.labels[valid]
+        return np.bincount(labels, weights=midranks, minlength=self.cluster_count), \
+            np.bincount(labels, minlength=self.cluster_count).astype(np.float64)
+
+
+# Two selections of clusters to compare. Each cluster belongs to selection A or B and to a unit (a patient or
+# segment). Under the null hypothesis a unit's clusters are exchangeable: units in both selections have their
+# A and B clusters swapped at random, and units in one selection are shuffled between the selections.
+class ClusteredComparison:
+    def __init__(self, clusters, in_b, units):
+        self.clustered = ClusteredValues(clusters)
+        self.in_b = np.asarray(in_b, dtype=bool)
+        first_cluster = {}
+        pairs = []
+        for i, unit in enumerate(units):
+            if unit in first_cluster:
+                pairs.append((first_cluster.pop(unit), i))
+            else:
+                first_cluster[unit] = i
+        self.pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        self.unpaired = np.array(sorted(first_cluster.values()), dtype=np.int64)
+        self.rank_sums, self.valid_counts = self.clustered.rank_sums()
+
+    # Returns the selection of every cluster in count random relabellings, with shape (count, clusters)
+    def permuted_selections(self, rng, count):
+        in_b = np.tile(self.in_b, (count, 1))
+        if len(self.pairs):
+            swap = rng.random((count, len(self.pairs))) < 0.5
+            first, second = in_b[:, self.pairs[:, 0]], in_b[:, self.pairs[:, 1]]
+            in_b[:, self.pairs[:, 0]] = np.where(swap, second, first)
+            in_b[:, self.pairs[:, 1]] = np.where(swap, first, second)
+        if len(self.unpaired) > 1:
+            order = np.argsort(rng.random((count, len(self.unpaired))), axis=1)
+            in_b[:, self.unpaired] = self.in_b[self.unpaired][order]
+        return in_b
+
+    # Returns the difference of medians (B - A) and the Mann-Whitney probability that a value of B exceeds one
+    # of A (counting ties as one half) for each labelling, with shape (labellings, 2)
+    def statistics(self, in_b):
+        weights_b = in_b.astype(np.float64)
+        weights_a = 1. - weights_b
+        median_difference = self.clustered.weighted_quantiles(weights_b, [.5])[:, 0] - \
+            self.clustered.weighted_quantiles(weights_a, [.5])[:, 0]
+        count_a, count_b = weights_a @ self.valid_counts, weights_b @ self.valid_counts
+        u = weights_b @ self.rank_sums - count_b * (count_b + 1) / 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.column_stack([median_difference, u / (count_a * count_b)])
+
+    # Returns the observed statistics and the Mann-Whitney U statistic of B
+    def observed(self):
+        statistics = self.statistics(self.in_b[np.newaxis])[0]
+        count_a, count_b = self.valid_counts[~self.in_b].sum(), self.valid_counts[self.in_b].sum()
+        return statistics, statistics[1] * count_a * count_b
+
+
+# Median and interquartile range of count patient level bootstrap resamples; run in worker processes
+def bootstrap_chunk(task):
+    clustered, seed, count = task
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(clustered.cluster_count, np.full(clustered.cluster_count, 1. / clustered.cluster_count),
+                              size=count).astype(np.float64)
+    quartiles = clustered.weighted_quantiles(weights, [.25, .5, .75])
+    return np.column_stack([quartiles[:, 1], quartiles[:, 2] - quartiles[:, 0]])
+
+
+# Statistics of count random relabellings of a comparison; run in worker processes
+def permutation_chunk(task):
+    comparison, seed, count = task
+    return comparison.statistics(comparison.permuted_selections(np.random.default_rng(seed), count))
+
+
+# Runs resampling chunks in this process, or in a process pool when more than one process is requested
+class Resampler:
+    def __init__(self, replicates=default_replicates, permutations=default_permutations,
+                 confidence_level=default_confidence_level, seed=0, processes=1):
+        if replicates < 1 or permutations < 1:
+            raise ValueError('Resampling needs at least one replicate and one permutation')
+        if not 0 < confidence_level < 1:
+            raise ValueError('Confidence level must be between 0 and 1')
+        self.replicates = replicates
+        self.permutations = permutations
+        self.confidence_level = confidence_level
+        self.seed = seed
+        self.processes = processes
+        self._executor = None
+
+    # Returns the seed and size of each chunk of count resamples of the given parameter
+    def chunks(self, param_name, count):
+        sizes = [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+        seeds = np.random.SeedSequence([self.seed, zlib.crc32(param_name.encode('utf-8'))]).spawn(len(sizes))
+        return list(zip(seeds, sizes))
+
+    def map(self, function, tasks):
+        if self.processes == 1 or len(tasks) < 2:
+            return [function(task) for task in tasks]
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.processes)
+        return list(self._executor.map(function, tasks))
+
+    # Shuts down the process pool, if one was started
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    # Percentile bootstrap intervals of the median and interquartile range of each parameter's clustered
+    # values, with shape (parameters, 4) as median lower, median upper, IQR lower and IQR upper bounds
+    def bootstrap_intervals(self, param_names, clustered_values):
+        tasks, owners = [], []
+        for i, (param_name, clustered) in enumerate(zip(param_names, clustered_values)):
+            if clustered.cluster_count:
+                for seed, size in self.chunks(param_name, self.replicates):
+                    tasks.append((clustered, seed, size))
+                    owners.append(i)
+        results = self.map(bootstrap_chunk, tasks)
+        tail = (1 - self.confidence_level) / 2
+        intervals = np.full((len(param_names), 4), np.nan)
+        for i in set(owners):
+            statistics = np.concatenate([result for owner, result in zip(owners, results) if owner == i])
+            with np.errstate(invalid='ignore'):
+                if np.isfinite(statistics).any(axis=0).all():
+                    intervals[i] = np.nanquantile(statistics, [tail, 1 - tail], axis=0).T.ravel()
+        return intervals
+
+    # Permutation tests of each parameter's comparison. Returns the observed median differences, Mann-Whitney
+    # U statistics and probabilities that B exceeds A, and the two-sided p-values of the median difference and
+    # of the Mann-Whitney probability, with shape (parameters, 5).
+    def compare(self, param_names, comparisons):
+        tasks, owners = [], []
+        for i, (param_name, comparison) in enumerate(zip(param_names, comparisons)):
+            for seed, size in self.chunks(param_name, self.permutations):
+                tasks.append((comparison, seed, size))
+                owners.append(i)
+        results = self.map(permutation_chunk, tasks)
+        tests = np.full((len(param_names), 5), np.nan)
+        for i, comparison in enumerate(comparisons):
+            (median_difference, probability), u = comparison.observed()
+            permuted = np.concatenate([result for owner, result in zip(owners, results) if owner == i])
+            # Relabellings as extreme as the observed one, allowing for rounding in equal statistics
+            distances = np.abs(permuted - [0, 0.5])
+            observed = np.abs([median_difference, probability - 0.5])
+            with np.errstate(invalid='ignore'):
+                extreme = (distances >= observed * (1 - 1e-9)).sum(axis=0)
+            p_values = (1 + extreme) / (1 + len(permuted))
+            tests[i] = [median_difference, u, probability,
+                        *np.where(np.isnan(observed), np.nan, p_values)]
+        return tests
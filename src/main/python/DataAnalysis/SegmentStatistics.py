@@ -0,0 +1,141 @@
+import numpy as np
+
+from DataAnalysis.QuantileSketch import build_sketch
+from DataAnalysis.SegmentedArray import SegmentedArray
+
+
+# Sufficient statistics of one patient parameter, cached per segment at load time. Counts, totals and
+# centred sums of squares ignore NaN values (matching pandas mean/std) whilst the sorted values keep
+# them at the end of each segment (matching mquantiles). Each segment also has a quantile sketch for
+# approximate cohort quantiles. Values may be stored as float32, but the moments are always accumulated in
+# float64.
+class SegmentStatistics:
+    def __init__(self, counts, totals, squares, sorted_values, sketches):
+        self.counts = counts
+        self.totals = totals
+        self.squares = squares
+        self.sorted_values = sorted_values
+        self.sketches = sketches
+
+    # Computes the statistics of each segment of a segmented value store
+    @classmethod
+    def from_values(cls, segmented_values):
+        segment_count = segmented_values.segment_count
+        counts = np.zeros(segment_count, dtype=np.int64)
+        totals = np.zeros(segment_count, dtype=np.float64)
+        squares = np.zeros(segment_count, dtype=np.float64)
+        sorted_segments = []
+        for region in range(segment_count):
+            segment = np.sort(segmented_values.segment(region))
+            valid = np.asarray(segment[~np.isnan(segment)], dtype=np.float64)
+            counts[region] = len(valid)
+            if len(valid):
+                totals[region] = valid.sum()
+                squares[region] = np.square(valid - totals[region] / len(valid)).sum()
+            sorted_segments.append(segment)
+        return cls(counts, totals, squares, SegmentedArray.from_segments(sorted_segments),
+                   SegmentedArray.from_segments(build_sketch(segment) for segment in sorted_segments))
+
+
+# Merges per segment counts, totals and centred sums of squares along the last axis into means and sample
+# standard deviations, so one call summarises every parameter of a (parameters, segments) selection
+def merge_moments(counts, totals, squares):
+    count = counts.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = totals.sum(axis=-1) / count
+        segment_means = np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0)
+        deviations = np.square(segment_means - np.expand_dims(mean, -1), where=counts > 0,
+                               out=np.zeros_like(totals))
+        square_sum = squares.sum(axis=-1) + (counts * deviations).sum(axis=-1)
+        std = np.where(count > 1, np.sqrt(square_sum / (count - 1)), np.nan)
+    return mean, std
+
+
+# Quantiles of an already sorted array using the same plotting positions as scipy's mquantiles
+def plotting_position_quantiles(sorted_values, probabilities, alphap=0.5, betap=0.5):
+    return plotting_position_quantiles_batch([sorted_values], probabilities, alphap, betap)[0]
+
+
+# Quantiles of several sorted arrays at once, using the same plotting positions as scipy's mquantiles.
+# Returns an array of shape (arrays, probabilities).
+def plotting_position_quantiles_batch(sorted_arrays, probabilities, alphap=0.5, betap=0.5):
+    probabilities = np.atleast_1d(np.asarray(probabilities, dtype=np.float64))
+    n = np.array([len(sorted_values) for sorted_values in sorted_arrays])[:, np.newaxis]
+    aleph = n * probabilities + (alphap + probabilities * (1. - alphap - betap))
+    k = np.floor(aleph.clip(1, np.maximum(n - 1, 1))).astype(int)
+    gamma = (aleph - k).clip(0, 1)
+    quantiles = np.full(aleph.shape, np.nan)
+    for i, sorted_values in enumerate(sorted_arrays):
+        if n[i, 0] == 1:
+            quantiles[i] = sorted_values[0]
+        elif n[i, 0] > 1:
+            quantiles[i] = (1. - gamma[i]) * sorted_values[k[i] - 1] + gamma[i] * sorted_values[k[i]]
+    return quantiles
+
+
+# Quantiles of every segment of a store of per segment sorted values at once, using the same plotting positions
+# as scipy's mquantiles. Returns an array of shape (segments, probabilities) that is NaN for empty segments.
+def segment_quantiles(sorted_values, probabilities, alphap=0.5, betap=0.5):
+    probabilities = np.atleast_1d(np.asarray(probabilities, dtype=np.float64))
+    n = sorted_values.lengths[:, np.newaxis]
+    if len(sorted_values.values) == 0:
+        return np.full((len(n), len(probabilities)), np.nan)
+    aleph = n * probabilities + (alphap + probabilities * (1. - alphap - betap))
+    k = np.floor(aleph.clip(1, np.maximum(n - 1, 1))).astype(int)
+    gamma = (aleph - k).clip(0, 1)
+    starts = sorted_values.offsets[:-1, np.newaxis]
+    last = len(sorted_values.values) - 1
+    lower = sorted_values.values[np.minimum(starts + k - 1, last)]
+    upper = sorted_values.values[np.minimum(starts + k, last)]
+    return np.where(n > 1, (1. - gamma) * lower + gamma * upper, np.where(n == 1, lower, np.nan))
+
+
+# Inserts sorted values into a sorted array, keeping it sorted. Values are first stored in the array's type, which
+# is float32 once a memory budget has compacted it.
+def insert_sorted(sorted_values, additions):
+    additions = additions.astype(sorted_values.dtype, copy=False)
+    return np.insert(sorted_values, np.searchsorted(sorted_values, additions, side='right'), additions)
+
+
+# Removes sorted values from a sorted array that contains them, keeping it sorted
+def remove_sorted(sorted_values, removals):
+    removals = removals.astype(sorted_values.dtype, copy=False)
+    first_equal = np.searchsorted(sorted_values, removals, side='left')
+    repeat_offsets = np.arange(len(removals)) - np.searchsorted(removals, removals, side='left')
+    return np.delete(sorted_values, first_equal + repeat_offsets)
+
+
+# Sorted values of every (patient, region) pair in a selection for each diffusion parameter. Each parameter's
+# sorted values are brought up to date with the selection only when they are requested, by merging or
+# removing the changed segments rather than re-sorting the whole cohort.
+class CohortAggregate:
+    def __init__(self):
+        self.selection = set()
+        self.pools = {}
+
+    # Returns the sorted values of a parameter across all selected segments
+    def sorted_values(self, param_name, patient_statistics):
+        pool_selection, pool = self.pools.get(param_name, (set(), np.empty(0, dtype=np.float64)))
+        if pool_selection != self.selection:
+            removed = self.gather(param_name, pool_selection - self.selection, patient_statistics)
+            if len(removed):
+                pool = remove_sorted(pool, removed)
+            added = self.gather(param_name, self.selection - pool_selection, patient_statistics)
+            if len(added):
+                pool = insert_sorted(pool, added)
+            self.pools[param_name] = (self.selection, pool)
+        return pool
+
+    # Drops a patient's segments whilst its statistics are still available
+    def remove_patient(self, patient_identifier, patient_statistics):
+        self.selection = {pair for pair in self.selection if pair[0] != patient_identifier}
+        for param_name in list(self.pools):
+            self.sorted_values(param_name, patient_statistics)
+
+    @staticmethod
+    def gather(param_name, pairs, patient_statistics):
+        segments = [patient_statistics[patient_identifier][param_name].sorted_values.segment(region)
+                    for patient_identifier, region in pairs if param_name in patient_statistics[patient_identifier]]
+        if not segments:
+            return np.empty(0, dtype=np.float64)
+        return np.sort(np.concatenate(segments))
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+# Contiguous float64 value store for one diffusion parameter of one patient. Segment i occupies
+# values[offsets[i]:offsets[i + 1]], so selecting regions never copies through Python lists. Under a memory
+# budget the values are replaced in place by float32 or memory-mapped copies, shared by every holder of the store.
+class SegmentedArray:
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    # Builds a store from a sequence of per segment value arrays
+    @classmethod
+    def from_segments(cls, segments):
+        segments = [np.asarray(segment, dtype=np.float64).ravel() for segment in segments]
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum([len(segment) for segment in segments], out=offsets[1:])
+        values = np.concatenate(segments) if segments else np.empty(0, dtype=np.float64)
+        return cls(values, offsets)
+
+    # Joins several stores into one holding all of their segments in order
+    @classmethod
+    def concatenate(cls, arrays):
+        starts = np.cumsum([0] + [array.offsets[-1] - array.offsets[0] for array in arrays])
+        offsets = np.concatenate([np.zeros(1, dtype=np.int64)] + [array.offsets[1:] - array.offsets[0] + start
+                                                                   for array, start in zip(arrays, starts)])
+        values = concatenate_slices([array.values[array.offsets[0]:array.offsets[-1]] for array in arrays])
+        return cls(values, offsets)
+
+    # Number of segments held in the store
+    @property
+    def segment_count(self):
+        return len(self.offsets) - 1
+
+    # Number of values in each segment
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    # Returns a view of the values of a single segment
+    def segment(self, region):
+        return self.values[self.offsets[region]:self.offsets[region + 1]]
+
+    # Returns the (start, stop) value ranges covering the given regions, merging adjacent segments
+    def ranges(self, regions):
+        ranges = []
+        for region in regions:
+            start, stop = self.offsets[region], self.offsets[region + 1]
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((start, stop))
+        return ranges
+
+    # Returns the values of the given regions in order, as a view when they form one contiguous run
+    def select(self, regions):
+        return concatenate_slices([self.values[start:stop] for start, stop in self.ranges(regions)])
+
+
+# Joins value slices, avoiding a copy when there is only a single slice
+def concatenate_slices(slices):
+    if len(slices) == 1:
+        return slices[0]
+    if not slices:
+        return np.empty(0, dtype=np.float64)
+    return np.concatenate(slices)
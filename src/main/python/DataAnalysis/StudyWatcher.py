@@ -0,0 +1,136 @@
+import os
+
+from PyQt5 import QtCore
+
+from DataAnalysis.PatientFiles import get_diffusion_parameters_file
+
+# Watches a study root for new and re-exported diffusion parameters. Changes are noticed through the operating
+# system's file notifications (inotify on Linux), and the study root is also polled, since notifications are
+# not delivered for network shares or once the notification limit is reached. An export is only reported once
+# its size and modification time are unchanged for the settle interval, so files still being written by the
+# reconstruction pipeline are not read.
+
+
+# Returns the size and modification time of the exported diffusion parameters of each patient directory of a
+# study root that has them
+def get_export_stamps(study_root):
+    stamps = {}
+    try:
+        entries = sorted(os.scandir(study_root), key=lambda entry: entry.name)
+    except OSError:
+        return stamps
+    for entry in entries:
+        if not entry.is_dir():
+            continue
+        try:
+            stat = os.stat(get_diffusion_parameters_file(entry.path))
+        except OSError:
+            continue
+        stamps[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return stamps
+
+
+# Returns the paths to watch for changes to the exports of a study root: the root, each patient directory and
+# the directories leading to its export, and the export itself
+def get_watched_paths(study_root):
+    paths = [study_root]
+    try:
+        entries = sorted(os.scandir(study_root), key=lambda entry: entry.name)
+    except OSError:
+        return paths
+    for entry in entries:
+        if not entry.is_dir():
+            continue
+        dp_file_path = get_diffusion_parameters_file(entry.path)
+        for path in [entry.path, os.path.dirname(os.path.dirname(dp_file_path)), os.path.dirname(dp_file_path)]:
+            if not os.path.isdir(path):
+                break
+            paths.append(path)
+        else:
+            if os.path.isfile(dp_file_path):
+                paths.append(dp_file_path)
+    return paths
+
+
+# Reports patient directories of a study root whose exports appear (exports_added) or are re-exported
+# (exports_modified). Exports already present when watching starts are reported as added.
+class StudyWatcher(QtCore.QObject):
+    exports_added = QtCore.pyqtSignal(list)
+    exports_modified = QtCore.pyqtSignal(list)
+
+    # Milliseconds between polls of the study root, and for which a changed export must stay unchanged
+    poll_interval = 5000
+    settle_interval = 1000
+
+    def __init__(self, study_root, parent=None):
+        super(StudyWatcher, self).__init__(parent)
+        self.study_root = os.path.abspath(study_root)
+        # Stamps of the exports last reported, and of changed exports waiting to settle
+        self.stamps = {}
+        self.changing = {}
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.schedule_scan)
+        self.watcher.fileChanged.connect(self.schedule_scan)
+        self.scan_timer = QtCore.QTimer(self)
+        self.scan_timer.setSingleShot(True)
+        self.scan_timer.setInterval(self.settle_interval)
+        self.scan_timer.timeout.connect(self.scan)
+        self.poll_timer = QtCore.QTimer(self)
+        self.poll_timer.setInterval(self.poll_interval)
+        self.poll_timer.timeout.connect(self.scan)
+
+    # Starts watching, reporting the exports already in the study root once they have settled
+    def start(self):
+        self.scan()
+        self.poll_timer.start()
+
+    def stop(self):
+        self.poll_timer.stop()
+        self.scan_timer.stop()
+        watched = self.watcher.files() + self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+
+    # Scans the study root once the settle interval has passed without further notifications
+    def schedule_scan(self, path=None):
+        self.scan_timer.start()
+
+    # Compares the exports of the study root with those last reported, reporting the changes that have settled
+    def scan(self):
+        stamps = get_export_stamps(self.study_root)
+        added, modified = [], []
+        for patient_data_directory, stamp in stamps.items():
+            if self.stamps.get(patient_data_directory) == stamp:
+                self.changing.pop(patient_data_directory, None)
+            elif self.changing.get(patient_data_directory) != stamp:
+                self.changing[patient_data_directory] = stamp
+            else:
+                del self.changing[patient_data_directory]
+                if patient_data_directory in self.stamps:
+                    modified.append(patient_data_directory)
+                else:
+                    added.append(patient_data_directory)
+                self.stamps[patient_data_directory] = stamp
+        for patient_data_directory in set(self.stamps) - set(stamps):
+            del self.stamps[patient_data_directory]
+        for patient_data_directory in set(self.changing) - set(stamps):
+            del self.changing[patient_data_directory]
+        self.update_watched_paths()
+        if self.changing:
+            self.scan_timer.start()
+        if added:
+            self.exports_added.emit(added)
+        if modified:
+            self.exports_modified.emit(modified)
+
+    # Watches the paths of exports that have appeared and stops watching those that have gone. Exports replaced
+    # by renaming are no longer watched by the file system watcher, so they are added again here.
+    def update_watched_paths(self):
+        watched = set(self.watcher.files() + self.watcher.directories())
+        paths = get_watched_paths(self.study_root)
+        removed = list(watched - set(paths))
+        if removed:
+            self.watcher.removePaths(removed)
+        added = [path for path in paths if path not in watched]
+        if added:
+            self.watcher.addPaths(added)
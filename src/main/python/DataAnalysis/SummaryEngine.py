@@ -0,0 +1,96 @@
+import numpy as np
+
+from DataAnalysis.QuantileSketch import rank_error, sketch_quantiles
+from DataAnalysis.SegmentStatistics import merge_moments, plotting_position_quantiles_batch, segment_quantiles
+from DataAnalysis.SegmentedArray import SegmentedArray
+
+summary_columns = ['Diffusion Parameter', 'Mean', 'Standard Deviation', 'Median', 'Interquartile Range',
+                   'Lower Quartile', 'Upper Quartile', 'Quartiles']
+segment_statistic_columns = summary_columns[1:-1]
+comparison_columns = ['Diffusion Parameter', 'Median Difference', 'Median Difference p', 'Mann-Whitney U',
+                      'P(B > A)', 'Mann-Whitney p']
+quartile_probabilities = [.25, .5, .75]
+exact_quartiles = 'Exact'
+approximate_quartiles = 'Approx. \u00b1{:.2%}'.format(rank_error)
+
+
+# Exact quartiles of each parameter from its sorted selected values, with shape (parameters, 3)
+def exact_quartiles_batch(sorted_pools):
+    return plotting_position_quantiles_batch(sorted_pools, quartile_probabilities), \
+        [exact_quartiles] * len(sorted_pools)
+
+
+# Approximate quartiles of each parameter from the merged sketches of its selected segments. Each entry of
+# sketches is a (points, weights) pair; parameters whose sketches all hold whole segments are exact.
+def approximate_quartiles_batch(sketches):
+    quartiles = np.empty((len(sketches), len(quartile_probabilities)))
+    modes = []
+    for i, (points, weights) in enumerate(sketches):
+        if np.all(weights == 1):
+            quartiles[i] = plotting_position_quantiles_batch([np.sort(points)], quartile_probabilities)[0]
+            modes.append(exact_quartiles)
+        else:
+            quartiles[i] = sketch_quantiles(points, weights, quartile_probabilities)
+            modes.append(approximate_quartiles)
+    return quartiles, modes
+
+
+# Summarises every parameter of a selection at once. counts, totals and squares hold the per segment moments
+# of the selected segments with shape (parameters, segments), quartiles holds each parameter's quartiles as
+# produced by exact_quartiles_batch or approximate_quartiles_batch, and scales multiplies each parameter's
+# summary. Values must already be transformed (e.g. absolute).
+def summarise_parameters(param_names, counts, totals, squares, quartiles, scales):
+    # pandas is imported when the first summary is computed, so it is not loaded at startup
+    import pandas as pd
+    quartiles, modes = quartiles
+    mean, std = merge_moments(counts, totals, squares)
+    statistics = np.column_stack([mean, std, quartiles[:, 1], quartiles[:, 2] - quartiles[:, 0],
+                                  quartiles[:, 0], quartiles[:, 2]]) * np.asarray(scales)[:, np.newaxis]
+    summary = pd.DataFrame(statistics, columns=summary_columns[1:-1])
+    summary.insert(0, summary_columns[0], list(param_names))
+    summary[summary_columns[-1]] = modes
+    return summary
+
+
+# Names of the bootstrap interval columns appended to summaries at the given confidence level
+def interval_columns(confidence_level):
+    level = f'{confidence_level:.0%}'
+    return [f'Median {level} CI Lower', f'Median {level} CI Upper', f'IQR {level} CI Lower',
+            f'IQR {level} CI Upper']
+
+
+# Appends bootstrap intervals of the median and interquartile range, with shape (parameters, 4) as produced by
+# Resampler.bootstrap_intervals, to a summary, scaling them as its statistics
+def add_interval_columns(summary, intervals, confidence_level, scales):
+    intervals = intervals * np.asarray(scales, dtype=np.float64)[:, np.newaxis]
+    for column, values in zip(interval_columns(confidence_level), intervals.T):
+        summary[column] = values
+    return summary
+
+
+# Tabulates the permutation tests of two selections, with shape (parameters, 5) as produced by
+# Resampler.compare. scales multiplies each parameter's median difference.
+def summarise_comparisons(param_names, tests, scales):
+    import pandas as pd
+    median_difference, u, probability, median_p, mann_whitney_p = tests.T
+    return pd.DataFrame({column: values for column, values in zip(comparison_columns, [
+        list(param_names), median_difference * np.asarray(scales, dtype=np.float64), median_p, u, probability,
+        mann_whitney_p])})
+
+
+# Exact quartiles of every segment of several stores of per segment sorted values, with shape
+# (stores, segments per store, 3)
+def segment_quartiles_batch(sorted_values, segment_count):
+    return segment_quantiles(SegmentedArray.concatenate(sorted_values), quartile_probabilities).reshape(
+        len(sorted_values), segment_count, len(quartile_probabilities))
+
+
+# Summarises every segment on its own. counts, totals and squares have shape (patients, parameters, segments),
+# quartiles (patients, parameters, segments, 3) and scales multiplies each parameter's statistics. Returns an
+# array of shape (patients, segments, parameters, statistics) ordered as segment_statistic_columns.
+def summarise_segments(counts, totals, squares, quartiles, scales):
+    mean, std = merge_moments(counts[..., np.newaxis], totals[..., np.newaxis], squares[..., np.newaxis])
+    statistics = np.stack([mean, std, quartiles[..., 1], quartiles[..., 2] - quartiles[..., 0], quartiles[..., 0],
+                           quartiles[..., 2]], axis=-1)
+    statistics *= np.asarray(scales, dtype=np.float64)[:, np.newaxis, np.newaxis]
+    return statistics.transpose(0, 2, 1, 3)
@@ -0,0 +1,84 @@
+import traceback
+
+from PyQt5 import QtCore
+
+
+# Runs one summary computation on a worker thread unless a newer job for the same key has replaced it
+class SummaryJob(QtCore.QRunnable):
+    def __init__(self, scheduler, key, generation, function):
+        super(SummaryJob, self).__init__()
+        self.scheduler = scheduler
+        self.key = key
+        self.generation = generation
+        self.function = function
+
+    def run(self):
+        if not self.scheduler.is_current(self.key, self.generation):
+            return
+        try:
+            result, error = self.function(), None
+        except Exception as exception:
+            result, error = None, exception
+        self.scheduler.job_finished.emit(self.key, self.generation, result, error)
+
+
+# Computes summaries off the GUI thread. Requests for the same key within the debounce interval are
+# coalesced into one job, and the result of a job that has since been superseded is dropped, so callbacks
+# only ever see the latest result for each key. A job that raises is reported through job_failed with its key
+# and exception instead of calling its callback.
+class SummaryScheduler(QtCore.QObject):
+    job_finished = QtCore.pyqtSignal(object, int, object, object)
+    job_failed = QtCore.pyqtSignal(object, object)
+
+    debounce_interval = 40
+
+    def __init__(self, parent=None):
+        super(SummaryScheduler, self).__init__(parent)
+        self._generations = {}
+        self._pending = {}
+        self._callbacks = {}
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.submit_pending)
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self.job_finished.connect(self._deliver)
+
+    # Schedules function to run in the background, replacing any request for the same key not yet delivered.
+    # callback receives the result on the GUI thread.
+    def schedule(self, key, function, callback):
+        self._pending[key] = (function, callback)
+        self._timer.start(self.debounce_interval)
+
+    # Drops pending and running work for a key
+    def cancel(self, key):
+        self._pending.pop(key, None)
+        self._callbacks.pop(key, None)
+        self._generations[key] = self._generations.get(key, 0) + 1
+
+    # Starts a job for every pending key
+    def submit_pending(self):
+        pending, self._pending = self._pending, {}
+        for key, (function, callback) in pending.items():
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+            self._callbacks[key] = callback
+            self._pool.start(SummaryJob(self, key, generation, function))
+
+    # Returns whether a job is the latest one for its key
+    def is_current(self, key, generation):
+        return self._generations.get(key) == generation
+
+    # Returns whether any request has not been delivered yet
+    def is_busy(self):
+        return bool(self._pending) or bool(self._callbacks)
+
+    def _deliver(self, key, generation, result, error):
+        if not self.is_current(key, generation):
+            return
+        callback = self._callbacks.pop(key)
+        if error is not None:
+            traceback.print_exception(type(error), error, error.__traceback__)
+            self.job_failed.emit(key, error)
+            return
+        callback(result)
@@ -0,0 +1,153 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zipfile
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+
+from DataAnalysis import DiffusionParameterData as dpd
+from DataAnalysis.LazyMapping import LazyMapping
+from DataAnalysis.PatientFiles import LoadedPatient
+from DataAnalysis.SegmentStatistics import SegmentStatistics
+from DataAnalysis.SegmentedArray import SegmentedArray
+
+# A workspace is an uncompressed zip of .npy arrays holding every loaded patient's parameter values and
+# computed segment statistics, with a JSON manifest of their segment offsets, region selections, the derived
+# parameters and the quartile mode. Members are stored rather than deflated, so on reopen the whole file is
+# memory-mapped once and each array is a view of its bytes; only the patients that are summarised or viewed
+# are paged in.
+workspace_format = 1
+manifest_name = 'workspace.json'
+workspace_extension = '.dtcmr'
+
+# Local file header of a zip member: signature, versions, flags, dates, sizes and name and extra lengths
+local_header = struct.Struct('<4s5H3L2H')
+
+# Contents of an opened workspace. Patients are LoadedPatients whose arrays are views of the mapped file.
+OpenedWorkspace = namedtuple('OpenedWorkspace', ['quantile_mode', 'derived_parameters', 'patients',
+                                                 'patient_regions'])
+
+
+# Writes a registry's patients, with their region selections and directories when given, to a workspace file.
+# The file is written next to its destination and then moved into place.
+def save_workspace(path, registry, patient_regions=None, patient_directories=None):
+    patient_regions = patient_regions or {}
+    patient_directories = patient_directories or {}
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, staging = tempfile.mkstemp(dir=directory, prefix='.staging-', suffix=workspace_extension)
+    os.close(file_descriptor)
+    try:
+        with registry.lock, zipfile.ZipFile(staging, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            manifest = {'format': workspace_format, 'quantile_mode': registry.quantile_mode,
+                        'derived_parameters': [[name, derived.expression]
+                                               for name, derived in registry.derived_parameters.items()
+                                               if name not in dpd.default_derived_parameters],
+                        'patients': []}
+            for i, (patient_identifier, diffusion_parameters) in enumerate(registry.patient_entries.items()):
+                manifest['patients'].append(write_patient(archive, f'{i}/', diffusion_parameters,
+                                                          registry.patient_statistics[patient_identifier]))
+                manifest['patients'][-1].update({
+                    'identifier': patient_identifier, 'directory': patient_directories.get(patient_identifier),
+                    'regions': [int(region) for region in patient_regions.get(patient_identifier, [])]})
+            archive.writestr(manifest_name, json.dumps(manifest))
+        os.replace(staging, path)
+    except BaseException:
+        os.remove(staging)
+        raise
+
+
+# Writes one patient's parameter values and segment statistics, returning its manifest entry
+def write_patient(archive, prefix, diffusion_parameters, patient_statistics):
+    entry = {'parameters': [], 'statistics': []}
+    for j, (param_name, values) in enumerate(diffusion_parameters.items()):
+        write_array(archive, f'{prefix}values_{j}.npy', values.values)
+        entry['parameters'].append([param_name, values.offsets.tolist()])
+    # Statistics of derived parameters added to the registry are recomputed from the values when needed
+    statistics = patient_statistics.statistics
+    for j, param_name in enumerate(statistics):
+        param_statistics = statistics[param_name]
+        write_array(archive, f'{prefix}sorted_{j}.npy', param_statistics.sorted_values.values)
+        write_array(archive, f'{prefix}sketch_{j}.npy', param_statistics.sketches.values)
+        write_array(archive, f'{prefix}moments_{j}.npy', np.stack([param_statistics.counts, param_statistics.totals,
+                                                                   param_statistics.squares]))
+        entry['statistics'].append([param_name, param_statistics.sorted_values.offsets.tolist(),
+                                    param_statistics.sketches.offsets.tolist()])
+    return entry
+
+
+def write_array(archive, name, array):
+    with archive.open(name, 'w', force_zip64=True) as file:
+        np.lib.format.write_array(file, np.ascontiguousarray(array), allow_pickle=False)
+
+
+# Opens a workspace file, reading only its manifest. Raises ValueError when the file is not a workspace.
+def open_workspace(path):
+    try:
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read(manifest_name).decode('utf-8'))
+            members = {info.filename: info for info in archive.infolist()}
+    except (zipfile.BadZipFile, KeyError, ValueError):
+        raise ValueError(f'{path} is not a workspace file')
+    if manifest.get('format') != workspace_format:
+        raise ValueError(f'{path} was saved in an unsupported workspace format')
+    if any(info.compress_type != zipfile.ZIP_STORED for info in members.values()):
+        raise ValueError(f'{path} has compressed members, which cannot be memory-mapped')
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    read = partial(read_member_array, mapped, members)
+    patients = [open_patient(read, f'{i}/', entry) for i, entry in enumerate(manifest['patients'])]
+    return OpenedWorkspace(manifest['quantile_mode'], [tuple(derived) for derived in manifest['derived_parameters']],
+                           patients, {entry['identifier']: entry['regions'] for entry in manifest['patients']})
+
+
+# Returns a saved patient whose parameters and statistics are mapped the first time they are accessed
+def open_patient(read, prefix, entry):
+    parameters = {param_name: (j, offsets) for j, (param_name, offsets) in enumerate(entry['parameters'])}
+    statistics = {param_name: (j, offsets, sketch_offsets)
+                  for j, (param_name, offsets, sketch_offsets) in enumerate(entry['statistics'])}
+    diffusion_parameters = LazyMapping(parameters, partial(read_parameter, read, prefix, parameters))
+    patient_statistics = LazyMapping(statistics, partial(read_statistics, read, prefix, statistics))
+    return LoadedPatient(entry['identifier'], entry['directory'], diffusion_parameters, patient_statistics)
+
+
+def read_parameter(read, prefix, parameters, param_name):
+    j, offsets = parameters[param_name]
+    return SegmentedArray(read(f'{prefix}values_{j}.npy'), np.asarray(offsets, dtype=np.int64))
+
+
+def read_statistics(read, prefix, statistics, param_name):
+    j, offsets, sketch_offsets = statistics[param_name]
+    moments = read(f'{prefix}moments_{j}.npy')
+    sorted_values = SegmentedArray(read(f'{prefix}sorted_{j}.npy'), np.asarray(offsets, dtype=np.int64))
+    sketches = SegmentedArray(read(f'{prefix}sketch_{j}.npy'), np.asarray(sketch_offsets, dtype=np.int64))
+    return SegmentStatistics(moments[0].astype(np.int64), moments[1], moments[2], sorted_values, sketches)
+
+
+# Returns a read-only view of a stored .npy member of the mapped workspace file
+def read_member_array(mapped, members, name):
+    info = members[name]
+    fields = local_header.unpack_from(mapped, info.header_offset)
+    start = info.header_offset + local_header.size + fields[-2] + fields[-1]
+    header = NpyHeaderReader(mapped, start)
+    if np.lib.format.read_magic(header) == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+    array = np.frombuffer(mapped, dtype=dtype, count=int(np.prod(shape)), offset=header.position)
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+# Minimal file interface over a mapped buffer, for numpy's .npy header readers
+class NpyHeaderReader:
+    def __init__(self, mapped, position):
+        self.mapped = mapped
+        self.position = position
+
+    def read(self, size):
+        data = self.mapped[self.position:self.position + size]
+        self.position += len(data)
+        return data
@@ -1,2 +1 @@
 from DataAnalysis import DiffusionParameterData
-from DataAnalysis import DataFrameModel
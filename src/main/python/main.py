@@ -1,17 +1,39 @@
 import csv
+import importlib
 import io
-import os
+import multiprocessing
 import sys
+import threading
 from functools import partial
 
-import pandas as pd
 from DataAnalysis import DataFrameModel as dfm, DiffusionParameterData as dpd
+from DataAnalysis.MemoryBudget import MemoryBudget
+from DataAnalysis.ParsedDataCache import ParsedDataCache
+from DataAnalysis.PatientFiles import get_patient_identifier
+from DataAnalysis.PatientLoader import PatientLoader
+from DataAnalysis.Profiler import profiler
+from DataAnalysis.QuantileSketch import rank_error
+from DataAnalysis.Resampling import Resampler, default_confidence_level
+from DataAnalysis.StudyWatcher import StudyWatcher
+from DataAnalysis.SummaryScheduler import SummaryScheduler
+from DataAnalysis.Workspace import open_workspace, save_workspace, workspace_extension
 from PyQt5 import QtWidgets, QtGui, QtCore
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QFileDialog, QPushButton, QAbstractItemView, QButtonGroup, QCheckBox, \
-    QVBoxLayout, QHBoxLayout, QGroupBox, QTableView, QLabel, QTabWidget, QTreeView, QListView, QGridLayout
+    QVBoxLayout, QHBoxLayout, QGroupBox, QTableView, QLabel, QTabWidget, QTreeView, QListView, QGridLayout, \
+    QProgressBar, QComboBox, QLineEdit, QSpinBox
 from fbs_runtime.application_context.PyQt5 import ApplicationContext
-from scipy.io import loadmat
+
+# Modules only needed once patients are loaded. They are left out of startup and imported in the background
+# once the window is shown.
+deferred_modules = ['pandas', 'scipy.io']
+max_memory_budget_megabytes = 1024 ** 2
+watch_study_tooltip = "Load new and re-exported patients of a study folder automatically"
+
+
+def import_deferred_modules():
+    for module_name in deferred_modules:
+        importlib.import_module(module_name)
 
 
 class App(QWidget):
@@ -22,14 +44,48 @@ class App(QWidget):
         self.top = 10
         self.width = 1920
         self.height = 1080
+        # Single registry of all patients' data, shared by the per patient views in patient_data_sets
         self.combined_patients_summary_data = dpd.DiffusionParameterData()
         self.combined_selected_regions_table = QTableView()
         self.combined_global_table = QTableView()
         self.combined_patients = set()
         self.combined_patients_table = QTableView()
+        self.segment_statistics = None
+        self.segment_statistics_table = QTableView()
+        self.segment_parameter_combo_box = QComboBox()
+        self.segment_statistic_combo_box = QComboBox()
         self.patient_data_sets = dict()
         self.patient_regions = dict()
+        self.patient_directories = dict()
         self.patient_data_UIs = dict()
+        self.patient_tables = dict()
+        self.loading_patients = set()
+        # Patients re-exported whilst they were loading, which are loaded again once that load is ingested
+        self.stale_patients = set()
+        self.loaded_patients = []
+        self.load_errors = []
+        self.patient_loaders = []
+        self.parsed_data_cache = ParsedDataCache()
+        self.load_progress = QProgressBar()
+        self.cancel_load_button = QPushButton("Cancel")
+        self.watch_study_button = QPushButton("Watch Study Folder")
+        self.study_watcher = None
+        self.approximate_quartiles_check_box = QCheckBox("Approximate Quartiles")
+        self.resampling_check_box = QCheckBox("Bootstrap Intervals")
+        self.regions_comparison_label = self.create_title('Selected vs Unselected Regions', Qt.AlignCenter)
+        self.regions_comparison_table = QTableView()
+        self.derived_parameter_edit = QLineEdit()
+        self.memory_budget_spin_box = QSpinBox()
+        self.resident_label = QLabel()
+        self.memory_timer = QtCore.QTimer(self)
+        self.profile_check_box = QCheckBox("Profile")
+        self.profile_label = QLabel()
+        self.export_trace_button = QPushButton("Export Trace")
+        self.profile_timer = QtCore.QTimer(self)
+        self.error_dialog = QtWidgets.QErrorMessage(self)
+        self.ingest_timer = QtCore.QTimer(self)
+        self.summary_scheduler = SummaryScheduler(self)
+        self.summary_scheduler.job_failed.connect(self.report_summary_error)
         self.tabs = QTabWidget()
         self.vbox2 = QVBoxLayout()
         self.hbox = QHBoxLayout()
@@ -44,23 +100,124 @@ class App(QWidget):
         load_file_button.clicked.connect(self.open_file_dialog)
         load_file_box = QHBoxLayout()
         load_file_box.addWidget(load_file_button, 0, Qt.AlignLeading)
+
+        # Workspaces save the loaded patients and their region selections
+        open_workspace_button = QPushButton("Open Workspace")
+        open_workspace_button.clicked.connect(self.open_workspace)
+        save_workspace_button = QPushButton("Save Workspace")
+        save_workspace_button.clicked.connect(self.save_workspace)
+        load_file_box.addWidget(open_workspace_button, 0, Qt.AlignLeading)
+        load_file_box.addWidget(save_workspace_button, 0, Qt.AlignLeading)
+
+        # New and re-exported patients of a watched study root are loaded as the pipeline writes them
+        self.watch_study_button.setCheckable(True)
+        self.watch_study_button.setToolTip(watch_study_tooltip)
+        self.watch_study_button.toggled.connect(self.set_watching)
+        load_file_box.addWidget(self.watch_study_button, 0, Qt.AlignLeading)
+
+        # Background loading progress
+        self.load_progress.setFormat("Loading patients %v/%m")
+        self.load_progress.setRange(0, 0)
+        self.load_progress.setValue(0)
+        self.load_progress.hide()
+        self.cancel_load_button.clicked.connect(self.cancel_loading)
+        self.cancel_load_button.hide()
+        load_file_box.addWidget(self.load_progress, 1)
+        load_file_box.addWidget(self.cancel_load_button)
+
+        # Quartiles from merged quantile sketches for very large cohorts
+        self.approximate_quartiles_check_box.setToolTip(
+            f'Estimate quartiles from per segment quantile sketches, to within \u00b1{rank_error:.2%} in rank')
+        self.approximate_quartiles_check_box.toggled.connect(self.set_approximate_quartiles)
+        load_file_box.addWidget(self.approximate_quartiles_check_box)
+
+        # Patient level bootstrap intervals and permutation tests
+        self.resampling_check_box.setToolTip(
+            f'Add {default_confidence_level:.0%} bootstrap intervals of the median and IQR, resampling whole '
+            f'patients, and compare selected with unselected regions')
+        self.resampling_check_box.toggled.connect(self.set_resampling)
+        load_file_box.addWidget(self.resampling_check_box)
         self.vbox2.addLayout(load_file_box)
+
+        # User defined parameters computed from the exported ones
+        derived_parameter_box = QHBoxLayout()
+        self.derived_parameter_edit.setPlaceholderText("Derived parameter, e.g. FA * MD")
+        self.derived_parameter_edit.returnPressed.connect(self.add_derived_parameter)
+        add_derived_parameter_button = QPushButton("Add Parameter")
+        add_derived_parameter_button.clicked.connect(self.add_derived_parameter)
+        derived_parameter_box.addWidget(self.derived_parameter_edit, 1)
+        derived_parameter_box.addWidget(add_derived_parameter_button)
+        self.vbox2.addLayout(derived_parameter_box)
+
+        # Limit on the parameter values held in memory, with the size currently held
+        memory_box = QHBoxLayout()
+        memory_budget = MemoryBudget.from_environment()
+        self.combined_patients_summary_data.memory_budget = memory_budget
+        self.memory_budget_spin_box.setRange(0, max_memory_budget_megabytes)
+        self.memory_budget_spin_box.setSingleStep(256)
+        self.memory_budget_spin_box.setSuffix(" MB")
+        self.memory_budget_spin_box.setSpecialValueText("No Memory Budget")
+        self.memory_budget_spin_box.setKeyboardTracking(False)
+        self.memory_budget_spin_box.setToolTip(
+            "Store values as float32 and move the least recently viewed patients to memory-mapped files to stay "
+            "within this size")
+        if memory_budget is not None:
+            self.memory_budget_spin_box.setValue(memory_budget.limit_bytes // 1024 ** 2)
+        self.memory_budget_spin_box.valueChanged.connect(self.set_memory_budget)
+        self.memory_timer.setInterval(2000)
+        self.memory_timer.timeout.connect(self.update_memory_budget)
+        self.memory_timer.start()
+        memory_box.addWidget(QLabel("Memory Budget"))
+        memory_box.addWidget(self.memory_budget_spin_box)
+        memory_box.addWidget(self.resident_label, 1)
+        self.vbox2.addLayout(memory_box)
+
+        # Loaded patients are added to the window in batches
+        self.ingest_timer.setSingleShot(True)
+        self.ingest_timer.setInterval(250)
+        self.ingest_timer.timeout.connect(self.ingest_loaded_patients)
         self.hbox.addLayout(self.vbox2)
 
         self.tabs.setTabsClosable(True)
         self.tabs.setMovable(True)
         self.tabs.setUsesScrollButtons(True)
         self.tabs.tabCloseRequested.connect(lambda index: self.remove_data(index))
+        self.tabs.currentChanged.connect(self.build_patient_tab)
         self.hbox.addWidget(self.tabs)
 
         self.display_combined_patient_summary()
 
+        # Opt-in profiling, showing the latency of the last instrumented operation
+        profile_box = QHBoxLayout()
+        self.profile_check_box.setToolTip("Record the time and memory of loading and summary stages")
+        self.profile_check_box.setChecked(profiler.enabled)
+        self.profile_check_box.toggled.connect(self.set_profiling)
+        self.export_trace_button.clicked.connect(self.export_trace)
+        self.profile_timer.setInterval(500)
+        self.profile_timer.timeout.connect(self.update_profile_label)
+        profile_box.addWidget(self.profile_check_box)
+        profile_box.addWidget(self.profile_label, 1)
+        profile_box.addWidget(self.export_trace_button)
+        self.vbox2.addLayout(profile_box)
+        self.set_profiling(profiler.enabled)
+
         self.setLayout(self.hbox)
         self.show()
+        QtCore.QTimer.singleShot(0, threading.Thread(target=import_deferred_modules, daemon=True).start)
 
-    # Method to add patient data summary to window
-    def display_patient_data(self, patient_identifier, data):
-        tab = QWidget()
+    # Method to add patient data summary to window. The tab's widgets are built the first time it is shown.
+    def display_patient_data(self, patient_identifier):
+        self.tabs.addTab(QWidget(), patient_identifier)
+
+    # Builds the widgets of a patient tab unless they have been built already
+    def build_patient_tab(self, index):
+        if index < 0:
+            return
+        patient_identifier = self.tabs.tabText(index)
+        self.combined_patients_summary_data.touch_patient(patient_identifier)
+        if patient_identifier in self.patient_tables:
+            return
+        tab = self.tabs.widget(index)
         tab_layout = QHBoxLayout()
         vbox1 = QVBoxLayout()
         vbox2 = QVBoxLayout()
@@ -95,11 +252,15 @@ class App(QWidget):
 
         vbox2.addStretch(1)
         self.create_region_selection(vbox2, region_select_buttons, regions_summary_table, patient_identifier)
-        self.load_table_view(data, summary_table)
+        self.patient_tables[patient_identifier] = (summary_table, regions_summary_table)
+        self.summary_scheduler.schedule(('Global', patient_identifier),
+                                        self.patient_data_sets[patient_identifier].get_global_summary,
+                                        partial(self.load_table_view, table=summary_table))
+        if self.patient_regions[patient_identifier]:
+            self.update_patient_regions_summary(patient_identifier)
         tab_layout.addLayout(vbox1)
         tab_layout.addLayout(vbox2)
         tab.setLayout(tab_layout)
-        self.tabs.addTab(tab, patient_identifier)
 
     # Creates a title object
     def create_title(self, text, alignment):
@@ -127,6 +288,7 @@ class App(QWidget):
         hbox = QHBoxLayout()
         for i in range(0, 12):
             check_box = QCheckBox(str(i + 1))
+            check_box.setChecked(i in self.patient_regions[patient_identifier])
             check_box.clicked.connect(
                 partial(self.update_selected_region_summary, buttonGroup, region_summary_table, patient_identifier))
             vbox.addWidget(check_box)
@@ -147,20 +309,103 @@ class App(QWidget):
     def invert_buttons(self, regions_buttons, region_summary_table, patient_identifier):
         for button in regions_buttons.buttons():
             button.toggle()
-            button.repaint()
         self.update_selected_region_summary(regions_buttons, region_summary_table, patient_identifier)
 
-    #   Updates selected region summary table
+    #   Updates selected region summary table once the latest selection has been summarised in the background
     def update_selected_region_summary(self, region_buttons, region_summary_table, patient_identifier):
-        regions = [i for i, button in enumerate(region_buttons.buttons()) if button.isChecked()]
-        regions_summary = self.patient_data_sets[patient_identifier].get_regions_summary(regions, patient_identifier)
-        self.patient_regions[patient_identifier] = regions
-        model = dfm.DataFrameModel(regions_summary)
-
-        region_summary_table.setModel(model)
-        region_summary_table.resizeColumnsToContents()
-        region_summary_table.repaint()
+        self.patient_regions[patient_identifier] = [i for i, button in enumerate(region_buttons.buttons())
+                                                    if button.isChecked()]
+        self.update_patient_regions_summary(patient_identifier)
+        self.update_combined()
+
+    #   Schedules a patient's selected region summary table update
+    def update_patient_regions_summary(self, patient_identifier):
+        regions = self.patient_regions[patient_identifier]
+        region_summary_table = self.patient_tables[patient_identifier][1]
+        self.summary_scheduler.schedule(('Selected Regions', patient_identifier),
+                                        partial(self.patient_data_sets[patient_identifier].get_regions_summary,
+                                                regions),
+                                        partial(self.load_table_view, table=region_summary_table))
+
+    # Switches between exact and approximate quartiles and refreshes every summary table
+    def set_approximate_quartiles(self, approximate):
+        with self.combined_patients_summary_data.lock:
+            self.combined_patients_summary_data.quantile_mode = \
+                dpd.approximate_quantile_mode if approximate else dpd.exact_quantile_mode
+        self.update_all_summaries()
+
+    # Adds bootstrap intervals to every summary and compares selected with unselected regions, or stops doing so
+    def set_resampling(self, enabled):
+        with self.combined_patients_summary_data.lock:
+            self.combined_patients_summary_data.resampler = Resampler() if enabled else None
+        self.regions_comparison_label.setVisible(enabled)
+        self.regions_comparison_table.setVisible(enabled)
+        self.update_all_summaries()
+
+    # Sets the memory budget in megabytes, or removes it when 0. Values already moved to mapped files stay
+    # there.
+    def set_memory_budget(self, megabytes):
+        registry = self.combined_patients_summary_data
+        with registry.lock:
+            if not megabytes:
+                if registry.memory_budget is not None:
+                    registry.memory_budget.close()
+                registry.memory_budget = None
+            elif registry.memory_budget is None:
+                registry.memory_budget = MemoryBudget(megabytes * 1024 ** 2)
+            else:
+                registry.memory_budget.limit_bytes = megabytes * 1024 ** 2
+        self.update_memory_budget()
+
+    # Brings the registry within its memory budget in the background once the summaries are up to date
+    def update_memory_budget(self):
+        if not self.summary_scheduler.is_busy():
+            self.summary_scheduler.schedule('Memory Budget', self.combined_patients_summary_data.enforce_memory_budget,
+                                            self.update_resident_label)
+
+    # Shows the size of the values held in memory
+    def update_resident_label(self, resident_bytes):
+        text = f"Resident: {resident_bytes / 1024 ** 2:.1f} MB"
+        if self.memory_budget_spin_box.value():
+            text += f" of {self.memory_budget_spin_box.value()} MB"
+        self.resident_label.setText(text)
+
+    # Deletes the memory budget's spill files when the window closes
+    def closeEvent(self, event):
+        with self.combined_patients_summary_data.lock:
+            if self.combined_patients_summary_data.memory_budget is not None:
+                self.combined_patients_summary_data.memory_budget.close()
+        super(App, self).closeEvent(event)
+
+    # Adds the derived parameter typed by the user to every summary
+    def add_derived_parameter(self):
+        try:
+            self.combined_patients_summary_data.add_derived_parameter(self.derived_parameter_edit.text())
+        except ValueError as error:
+            self.error_dialog.showMessage(str(error))
+            return
+        self.derived_parameter_edit.clear()
+        self.update_all_summaries()
+        self.update_segment_statistics()
+
+    # Refreshes every summary table
+    def update_all_summaries(self):
+        for patient_identifier in self.patient_tables:
+            self.update_patient_summaries(patient_identifier)
         self.update_combined()
+        self.update_combined_global()
+
+    # Refreshes the summary tables of a patient whose tab has been built
+    def update_patient_summaries(self, patient_identifier):
+        self.summary_scheduler.schedule(('Global', patient_identifier),
+                                        self.patient_data_sets[patient_identifier].get_global_summary,
+                                        partial(self.load_table_view, table=self.patient_tables[patient_identifier][0]))
+        self.update_patient_regions_summary(patient_identifier)
+
+    # Reports a summary that could not be computed, whose table still shows its previous result
+    def report_summary_error(self, key, error):
+        description = f'{key[0]} summary of {key[1]}' if isinstance(key, tuple) else key
+        self.error_dialog.showMessage(f'Could not update {description}: {error}')
 
     #   Copy event
     def eventFilter(self, source, event):
@@ -187,14 +432,47 @@ class App(QWidget):
             csv.writer(stream, delimiter='\t').writerows(table)
             QtWidgets.qApp.clipboard().setText(stream.getvalue())
 
-    #   Loads data into table view
+    #   Loads data into table view, updating its existing model in place
     def load_table_view(self, data, table):
-        model = dfm.DataFrameModel(data)
-        table.setModel(model)
-        table.resizeColumnsToContents()
-        table.repaint()
+        with profiler.span('load_table_view', 'view'):
+            model = table.model()
+            if isinstance(model, dfm.DataFrameModel):
+                if model.setDataFrame(data):
+                    table.resizeColumnsToContents()
+            else:
+                table.setModel(dfm.DataFrameModel(data, table))
+                table.resizeColumnsToContents()
         return self.vbox2
 
+    # Turns profiling on or off
+    def set_profiling(self, enabled):
+        if enabled:
+            profiler.enable()
+            self.profile_timer.start()
+        else:
+            profiler.disable()
+            self.profile_timer.stop()
+        self.profile_label.setVisible(enabled)
+        self.export_trace_button.setVisible(enabled or bool(profiler.events))
+        self.update_profile_label()
+
+    # Shows the latency of the last recorded operation
+    def update_profile_label(self):
+        event = profiler.last_event
+        if event is None:
+            self.profile_label.setText("No operations recorded")
+        else:
+            self.profile_label.setText(f"Last operation: {event['name']} {event['dur'] / 1000:.1f} ms")
+
+    # Saves the recorded operations as a Chrome trace
+    def export_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Trace", "trace.json", "Chrome trace (*.json)")
+        if path:
+            try:
+                profiler.export_chrome_trace(path)
+            except OSError as error:
+                self.error_dialog.showMessage(f'Could not export trace: {error}')
+
     # Displays combined patient summary section
     def display_combined_patient_summary(self):
         # Combined global table
@@ -223,8 +501,31 @@ class App(QWidget):
         grid.addLayout(vbox, 0, 4, 1, 3)
 
         self.vbox2.addLayout(grid)
-        self.update_combined()
-        self.update_combined_global()
+
+        # Permutation tests of the selected against the unselected regions of the selected patients
+        self.regions_comparison_table.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.regions_comparison_table.installEventFilter(self)
+        self.regions_comparison_label.hide()
+        self.regions_comparison_table.hide()
+        self.vbox2.addWidget(self.regions_comparison_label)
+        self.vbox2.addWidget(self.regions_comparison_table)
+
+        # Statistics of every segment of every patient
+        self.vbox2.addWidget(self.create_title('Segment Statistics', Qt.AlignCenter))
+        segment_statistics_box = QHBoxLayout()
+        self.segment_parameter_combo_box.addItems(self.combined_patients_summary_data.parameter_names)
+        self.segment_statistic_combo_box.addItems(dpd.segment_statistic_columns)
+        self.segment_parameter_combo_box.currentIndexChanged.connect(self.display_segment_statistics)
+        self.segment_statistic_combo_box.currentIndexChanged.connect(self.display_segment_statistics)
+        export_segment_statistics_button = QPushButton("Export")
+        export_segment_statistics_button.clicked.connect(self.export_segment_statistics)
+        segment_statistics_box.addWidget(self.segment_parameter_combo_box, 1)
+        segment_statistics_box.addWidget(self.segment_statistic_combo_box, 1)
+        segment_statistics_box.addWidget(export_segment_statistics_button)
+        self.vbox2.addLayout(segment_statistics_box)
+        self.segment_statistics_table.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.segment_statistics_table.installEventFilter(self)
+        self.vbox2.addWidget(self.segment_statistics_table)
 
     # Open selected patient tab
     def open_patient_tab(self):
@@ -235,33 +536,98 @@ class App(QWidget):
 
     # Combined global regions table update
     def update_combined_global(self):
-        summary = self.combined_patients_summary_data.get_combined_global_summary()
-        self.load_table_view(summary, self.combined_global_table)
+        self.summary_scheduler.schedule('Global Combined',
+                                        self.combined_patients_summary_data.get_combined_global_summary,
+                                        partial(self.load_table_view, table=self.combined_global_table))
 
     # Updates combined patient summary section
     def update_combined(self):
+        patient_regions = {patient_identifier: list(regions) for patient_identifier, regions in
+                           self.patient_regions.items()}
+        self.summary_scheduler.schedule('Selected Regions Combined',
+                                        partial(self.combined_patients_summary_data
+                                                .get_combined_patient_regions_summary, patient_regions),
+                                        partial(self.display_combined, patient_regions))
+        self.update_regions_comparison()
+
+    # Schedules the comparison of the selected (B) and unselected (A) regions when resampling is enabled
+    def update_regions_comparison(self):
+        if self.combined_patients_summary_data.resampler is None:
+            return
+        selected = {patient_identifier: list(regions) for patient_identifier, regions in self.patient_regions.items()
+                    if regions}
+        unselected = {patient_identifier: [region for region in range(dpd.region_count) if region not in regions]
+                      for patient_identifier, regions in selected.items()}
+        self.summary_scheduler.schedule('Regions Comparison',
+                                        partial(self.combined_patients_summary_data.get_selection_comparison,
+                                                unselected, selected),
+                                        partial(self.load_table_view, table=self.regions_comparison_table))
+
+    # Schedules the statistics of every segment of every patient
+    def update_segment_statistics(self):
+        self.summary_scheduler.schedule('Segment Statistics',
+                                        self.combined_patients_summary_data.get_segment_statistics,
+                                        self.set_segment_statistics)
+
+    def set_segment_statistics(self, segment_statistics):
+        self.segment_statistics = segment_statistics
+        # Derived parameters added since the picker was filled
+        self.segment_parameter_combo_box.addItems(segment_statistics[1][self.segment_parameter_combo_box.count():])
+        self.display_segment_statistics()
+
+    # Shows the selected statistic of the selected parameter for each patient and segment
+    def display_segment_statistics(self):
+        if self.segment_statistics is None:
+            return
+        import pandas as pd
+        patient_identifiers, param_names, statistics = self.segment_statistics
+        values = statistics[:, :, self.segment_parameter_combo_box.currentIndex(),
+                            self.segment_statistic_combo_box.currentIndex()]
+        self.load_table_view(pd.DataFrame(values, index=patient_identifiers,
+                                          columns=[f'Segment {region + 1}' for region in range(dpd.region_count)]),
+                             self.segment_statistics_table)
+
+    # Saves the statistics of every segment of every patient as CSV
+    def export_segment_statistics(self):
+        if self.segment_statistics is None:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export Segment Statistics", "segment_statistics.csv",
+                                              "CSV (*.csv)")
+        if path:
+            try:
+                dpd.get_segment_statistics_frame(self.segment_statistics).to_csv(path, index=False)
+            except OSError as error:
+                self.error_dialog.showMessage(f'Could not export segment statistics: {error}')
+
+    # Displays a combined patient summary computed for the given patient regions
+    def display_combined(self, patient_regions, summary):
+        import pandas as pd
         # Combined selected regions table update
-        summary = self.combined_patients_summary_data.get_combined_patient_regions_summary(self.patient_regions)
         self.load_table_view(summary, self.combined_selected_regions_table)
 
         # Combined patients table update
         data = [[patient_identifier, [i + 1 for i in regions]] for (patient_identifier, regions) in
-                self.patient_regions.items() if len(regions) > 0]
+                patient_regions.items() if len(regions) > 0]
         self.load_table_view(pd.DataFrame(data, columns=['Patients', 'Regions']),
                              self.combined_patients_table)
 
     # Removes patient data
     def remove_data(self, index):
         patient_identifier = self.tabs.tabText(index)
+        self.summary_scheduler.cancel(('Global', patient_identifier))
+        self.summary_scheduler.cancel(('Selected Regions', patient_identifier))
         self.patient_data_sets.pop(patient_identifier)
+        self.patient_tables.pop(patient_identifier, None)
+        self.patient_directories.pop(patient_identifier, None)
         if patient_identifier in self.patient_regions:
             self.patient_regions.pop(patient_identifier)
         self.combined_patients_summary_data.remove_patient_data(patient_identifier)
-        for box in self.patient_data_UIs[patient_identifier]:
+        for box in self.patient_data_UIs.pop(patient_identifier, []):
             self.clear_layout(box)
         self.tabs.removeTab(index)
         self.update_combined()
         self.update_combined_global()
+        self.update_segment_statistics()
 
     # Combines patient data and presents summary
     def combine_data(self, patient_identifier, toggled):
@@ -282,14 +648,85 @@ class App(QWidget):
                     self.clear_layout(child.layout())
 
     # Loads data to window
-    def load_data(self, patient_identifier, data):
-        self.patient_data_sets[patient_identifier] = dpd.DiffusionParameterData()
-        summary = self.patient_data_sets[patient_identifier].add_data(data, patient_identifier)
-        self.patient_regions[patient_identifier] = []
-        self.display_patient_data(patient_identifier, summary)
-        self.combined_patients_summary_data.add_data(data, patient_identifier)
-        self.update_combined_global()
-        self.tabs.repaint()
+    def load_data(self, patient, regions=()):
+        patient_identifier = patient.identifier
+        self.patient_data_sets[patient_identifier] = self.combined_patients_summary_data.add_parameters(
+            patient.diffusion_parameters, patient_identifier, patient.statistics)
+        self.patient_regions[patient_identifier] = list(regions)
+        self.patient_directories[patient_identifier] = patient.directory
+        self.display_patient_data(patient_identifier)
+
+    # Replaces a loaded patient's data with a re-export, keeping its tab and region selection
+    def replace_data(self, patient):
+        patient_identifier = patient.identifier
+        self.combined_patients_summary_data.replace_parameters(patient.diffusion_parameters, patient_identifier,
+                                                               patient.statistics)
+        self.patient_directories[patient_identifier] = patient.directory
+        if patient_identifier in self.patient_tables:
+            self.update_patient_summaries(patient_identifier)
+
+    # Saves the loaded patients, their region selections and the derived parameters as a workspace file
+    def save_workspace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save Workspace", f"workspace{workspace_extension}",
+                                              f"Workspace (*{workspace_extension})")
+        if path:
+            try:
+                save_workspace(path, self.combined_patients_summary_data, self.patient_regions,
+                               self.patient_directories)
+            except OSError as error:
+                self.error_dialog.showMessage(f'Could not save workspace: {error}')
+
+    # Opens a workspace file, adding its patients that are not already loaded with their region selections
+    def open_workspace(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open Workspace", "", f"Workspace (*{workspace_extension})")
+        if not path:
+            return
+        registry = self.combined_patients_summary_data
+        try:
+            workspace = open_workspace(path)
+            for name, expression in workspace.derived_parameters:
+                if name not in registry.derived_parameters:
+                    registry.add_derived_parameter(expression, name)
+        except (OSError, ValueError) as error:
+            self.error_dialog.showMessage(f'Could not open workspace: {error}')
+            return
+        self.tabs.setUpdatesEnabled(False)
+        for patient in workspace.patients:
+            if patient.identifier not in self.patient_data_sets and patient.identifier not in self.loading_patients:
+                self.load_data(patient, workspace.patient_regions[patient.identifier])
+        self.tabs.setUpdatesEnabled(True)
+        self.approximate_quartiles_check_box.setChecked(workspace.quantile_mode == dpd.approximate_quantile_mode)
+        self.update_all_summaries()
+        self.update_segment_statistics()
+
+    # Starts watching a study folder chosen by the user, or stops watching
+    def set_watching(self, enabled):
+        if not enabled:
+            self.watch_study_folder(None)
+            return
+        study_root = QFileDialog.getExistingDirectory(self, "Watch Study Folder")
+        if study_root:
+            self.watch_study_folder(study_root)
+        else:
+            self.watch_study_button.setChecked(False)
+
+    # Loads the patients of a study root, then new and re-exported patients as they appear. None stops watching.
+    def watch_study_folder(self, study_root):
+        if self.study_watcher is not None:
+            self.study_watcher.stop()
+            self.study_watcher.deleteLater()
+            self.study_watcher = None
+        self.watch_study_button.blockSignals(True)
+        self.watch_study_button.setChecked(study_root is not None)
+        self.watch_study_button.blockSignals(False)
+        if study_root is None:
+            self.watch_study_button.setToolTip(watch_study_tooltip)
+            return
+        self.study_watcher = StudyWatcher(study_root, self)
+        self.study_watcher.exports_added.connect(self.load_patient_directories)
+        self.study_watcher.exports_modified.connect(partial(self.load_patient_directories, replace=True))
+        self.watch_study_button.setToolTip(f"Watching {self.study_watcher.study_root}")
+        self.study_watcher.start()
 
     #   Allows user to open directories
     def open_file_dialog(self):
@@ -309,24 +746,102 @@ class App(QWidget):
             f_tree_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
 
         if dialog.exec():
-            paths = dialog.selectedFiles()
-            for patient_data_directory in paths:
-                patient_identifier = os.path.basename(patient_data_directory)
-                if patient_identifier not in self.patient_data_sets:
-                    dp_file_path = os.path.join(patient_data_directory, 'result_images', 'exported_data',
-                                                'diffusion_parameters.mat')
-                    if os.path.exists(dp_file_path):
-                        data = loadmat(dp_file_path)
-                        self.load_data(patient_identifier, data)
-                    else:
-                        error_dialog = QtWidgets.QErrorMessage()
-                        error_dialog.showMessage(
-                            f'File path error: {patient_data_directory} does not contain diffusion '
-                            f'parameters')
-                        error_dialog.exec_()
+            self.load_patient_directories(dialog.selectedFiles())
+
+    # Parses patient directories in the background, skipping patients already loading, and those already loaded
+    # unless their data is to be replaced by a re-export
+    def load_patient_directories(self, patient_data_directories, replace=False):
+        directories = []
+        for patient_data_directory in patient_data_directories:
+            patient_identifier = get_patient_identifier(patient_data_directory)
+            if patient_identifier in self.loading_patients:
+                if replace:
+                    self.stale_patients.add(patient_identifier)
+            elif replace or patient_identifier not in self.patient_data_sets:
+                self.loading_patients.add(patient_identifier)
+                directories.append(patient_data_directory)
+        if not directories:
+            return
+
+        loader = PatientLoader(directories, self.parsed_data_cache, parent=self)
+        loader.patient_loaded.connect(self.queue_loaded_patient)
+        loader.load_failed.connect(self.queue_load_error)
+        loader.progress.connect(self.update_load_progress)
+        loader.finished.connect(partial(self.finish_loading, loader))
+        self.patient_loaders.append(loader)
+        self.load_progress.setMaximum(self.load_progress.maximum() + len(directories))
+        self.load_progress.show()
+        self.cancel_load_button.show()
+        loader.start()
+
+    # Queues a parsed patient to be added with the next batch
+    def queue_loaded_patient(self, patient):
+        self.loaded_patients.append(patient)
+        if not self.ingest_timer.isActive():
+            self.ingest_timer.start()
+
+    # Records a directory that could not be loaded
+    def queue_load_error(self, patient_data_directory, message):
+        self.loading_patients.discard(get_patient_identifier(patient_data_directory))
+        self.stale_patients.discard(get_patient_identifier(patient_data_directory))
+        self.load_errors.append(f'{patient_data_directory}: {message}')
+
+    # Advances the loading progress bar by one patient
+    def update_load_progress(self, completed, total):
+        if completed > 0:
+            self.load_progress.setValue(self.load_progress.value() + 1)
+
+    # Adds all queued patients to the window, building their tabs in one batch
+    def ingest_loaded_patients(self):
+        if not self.loaded_patients:
+            return
+        self.tabs.setUpdatesEnabled(False)
+        replaced = False
+        stale = []
+        for patient in self.loaded_patients:
+            self.loading_patients.discard(patient.identifier)
+            if patient.identifier not in self.patient_data_sets:
+                self.load_data(patient)
+            else:
+                self.replace_data(patient)
+                replaced = True
+            if patient.identifier in self.stale_patients:
+                self.stale_patients.discard(patient.identifier)
+                stale.append(patient.directory)
+        self.loaded_patients = []
+        self.tabs.setUpdatesEnabled(True)
+        if replaced:
+            self.update_combined()
+        self.update_combined_global()
+        self.update_segment_statistics()
+        if stale:
+            self.load_patient_directories(stale, replace=True)
+
+    # Cancels all background loads
+    def cancel_loading(self):
+        for loader in self.patient_loaders:
+            loader.cancel()
+
+    # Tidies up after a background load, reporting every failed directory at once
+    def finish_loading(self, loader):
+        self.patient_loaders.remove(loader)
+        self.ingest_loaded_patients()
+        if loader.is_cancelled():
+            for patient_data_directory in loader.patient_data_directories:
+                self.loading_patients.discard(get_patient_identifier(patient_data_directory))
+        if not self.patient_loaders:
+            self.load_progress.hide()
+            self.load_progress.setRange(0, 0)
+            self.load_progress.setValue(0)
+            self.cancel_load_button.hide()
+            if self.load_errors:
+                self.error_dialog.showMessage('<br>'.join(self.load_errors))
+                self.load_errors = []
+        loader.deleteLater()
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     ctx = ApplicationContext()
     ex = App()
     exit_code = ctx.app.exec_()
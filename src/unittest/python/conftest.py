@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the application's modules as the viewer does, from src/main/python
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'main', 'python'))
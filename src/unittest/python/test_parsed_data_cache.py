@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Benchmarks.SyntheticStudy import write_patient
+from DataAnalysis import DiffusionParameterData as dpd
+from DataAnalysis.ParsedDataCache import ParsedDataCache
+from DataAnalysis.PatientFiles import load_patient
+
+
+class ParsedDataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.patient_data_directory = write_patient(os.path.join(self.directory, 'study'), 0, image_shape=None,
+                                                    nan_fraction=0.05)
+        self.cache = ParsedDataCache(os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # A patient loaded from the cache keeps its data once its entry is evicted, e.g. by another process sharing
+    # the cache directory
+    def test_summaries_after_eviction(self):
+        load_patient(self.patient_data_directory, self.cache)
+        patient = load_patient(self.patient_data_directory, self.cache)
+        registry = dpd.DiffusionParameterData()
+        registry.add_parameters(patient.diffusion_parameters, patient.identifier, patient.statistics)
+        registry.get_combined_global_summary()
+
+        self.cache.size_limit = 0
+        self.cache.evict()
+        self.assertEqual(os.listdir(self.cache.directory), [])
+        registry.add_derived_parameter('FA * MD')
+        summary = registry.get_combined_global_summary()
+
+        expected_registry = dpd.DiffusionParameterData()
+        expected = load_patient(self.patient_data_directory)
+        expected_registry.add_parameters(expected.diffusion_parameters, expected.identifier, expected.statistics)
+        expected_registry.add_derived_parameter('FA * MD')
+        expected_summary = expected_registry.get_combined_global_summary()
+        self.assertEqual(summary['Diffusion Parameter'].tolist(), expected_summary['Diffusion Parameter'].tolist())
+        np.testing.assert_array_equal(summary.iloc[:, 1:7].to_numpy(dtype=np.float64),
+                                      expected_summary.iloc[:, 1:7].to_numpy(dtype=np.float64))
+
+
+if __name__ == '__main__':
+    unittest.main()
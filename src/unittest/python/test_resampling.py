@@ -0,0 +1,121 @@
+import unittest
+
+import numpy as np
+from scipy.stats import mannwhitneyu
+from scipy.stats.mstats import mquantiles
+
+from DataAnalysis.Resampling import ClusteredComparison, ClusteredValues, Resampler
+
+probabilities = [0., .1, .25, .5, .75, .9, 1.]
+
+
+# Clusters of rounded values, so some are tied, with NaN values, empty clusters and enough values to split the
+# pooled values into several blocks
+def make_clusters(rng, sizes, nan_fraction=0.1):
+    clusters = []
+    for size in sizes:
+        values = np.round(rng.normal(size=size), 1)
+        values[rng.random(size) < nan_fraction] = np.nan
+        clusters.append(values)
+    return clusters
+
+
+# Quantiles of a weighted resample computed by repeating each cluster's values as often as it is drawn
+def expanded_quantiles(clusters, weights):
+    values = np.sort(np.concatenate([np.tile(cluster, int(weight)) for cluster, weight in zip(clusters, weights)]))
+    if len(values) == 0:
+        return np.full(len(probabilities), np.nan)
+    return mquantiles(values, probabilities, alphap=0.5, betap=0.5)
+
+
+class ClusteredValuesTest(unittest.TestCase):
+    def test_weighted_quantiles(self):
+        rng = np.random.default_rng(0)
+        clusters = make_clusters(rng, [40, 0, 150, 1, 75, 0, 230, 12])
+        clusters[7][:] = np.nan
+        weights = rng.integers(0, 4, size=(200, len(clusters))).astype(np.float64)
+        # Resamples of only empty clusters, of nothing, of a single value and of the NaN tail
+        weights[0] = [0, 3, 0, 0, 0, 1, 0, 0]
+        weights[1] = 0
+        weights[2] = [0, 0, 0, 1, 0, 0, 0, 0]
+        weights[3] = [0, 0, 0, 0, 0, 0, 0, 2]
+        clustered = ClusteredValues(clusters)
+        expected = np.array([expanded_quantiles(clusters, row) for row in weights])
+        np.testing.assert_allclose(clustered.weighted_quantiles(weights, probabilities), expected, rtol=1e-12)
+        self.assertTrue(np.isnan(expected[[0, 1, 3]]).all())
+
+    def test_rank_sums(self):
+        clusters = make_clusters(np.random.default_rng(1), [30, 0, 50, 20])
+        rank_sums, valid_counts = ClusteredValues(clusters).rank_sums()
+        self.assertEqual(valid_counts.tolist(), [np.count_nonzero(~np.isnan(cluster)) for cluster in clusters])
+        values = np.concatenate(clusters)
+        valid = values[~np.isnan(values)]
+        self.assertAlmostEqual(rank_sums.sum(), len(valid) * (len(valid) + 1) / 2)
+
+
+class ResamplerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(2)
+        cls.param_names = ['FA', 'MD']
+        cls.clustered_values = [ClusteredValues(make_clusters(rng, rng.integers(0, 80, size=12)))
+                                for _ in cls.param_names]
+        # Six patients, four with clusters in both selections
+        cls.comparisons = [ClusteredComparison(make_clusters(rng, rng.integers(1, 40, size=10)),
+                                               [False, True, False, True, False, True, False, True, False, True],
+                                               [0, 0, 1, 1, 2, 2, 3, 3, 4, 5]) for _ in cls.param_names]
+
+    def resample(self, **kwargs):
+        resampler = Resampler(replicates=600, permutations=600, **kwargs)
+        try:
+            return resampler.bootstrap_intervals(self.param_names, self.clustered_values), \
+                resampler.compare(self.param_names, self.comparisons)
+        finally:
+            resampler.close()
+
+    def test_reproducible(self):
+        intervals, tests = self.resample(seed=7)
+        self.assertTrue(np.isfinite(intervals).all())
+        self.assertTrue(np.isfinite(tests).all())
+        repeated_intervals, repeated_tests = self.resample(seed=7)
+        np.testing.assert_array_equal(repeated_intervals, intervals)
+        np.testing.assert_array_equal(repeated_tests, tests)
+        # The tied values leave the bootstrap intervals of another seed much the same, but not its p-values
+        _, other_tests = self.resample(seed=8)
+        self.assertFalse(np.array_equal(other_tests[:, 3:], tests[:, 3:]))
+
+    # Results do not depend on how many processes share the resampling
+    def test_process_pool(self):
+        intervals, tests = self.resample(seed=7)
+        pool_intervals, pool_tests = self.resample(seed=7, processes=2)
+        np.testing.assert_array_equal(pool_intervals, intervals)
+        np.testing.assert_array_equal(pool_tests, tests)
+
+    # Every value of B exceeds every value of A, and only the observed and swapped labellings of the four patients
+    # separate them completely, so 2 of the 6 labellings are as extreme as the observed one
+    def test_separated_comparison(self):
+        comparison = ClusteredComparison([np.array([1., 2., 3.]), np.array([4., 5.]), np.array([10., 11.]),
+                                          np.array([12., 13., 14.])], [False, False, True, True], [0, 1, 2, 3])
+        resampler = Resampler(permutations=3000, seed=0)
+        median_difference, u, probability, p_median, p_mw = resampler.compare(['FA'], [comparison])[0]
+        self.assertEqual(median_difference, 12. - 3.)
+        self.assertEqual(u, 25.)
+        self.assertEqual(probability, 1.)
+        self.assertAlmostEqual(p_mw, 1 / 3, delta=0.03)
+        self.assertGreaterEqual(p_median, p_mw)
+
+    def test_mann_whitney(self):
+        clusters = make_clusters(np.random.default_rng(3), [25, 0, 40, 33, 18])
+        in_b = [False, True, True, False, True]
+        comparison = ClusteredComparison(clusters, in_b, range(len(clusters)))
+        (_, probability), u = comparison.observed()
+        values_a, values_b = [np.concatenate([cluster for cluster, b in zip(clusters, in_b) if b == selection])
+                              for selection in [False, True]]
+        values_a, values_b = values_a[~np.isnan(values_a)], values_b[~np.isnan(values_b)]
+        expected_u = mannwhitneyu(values_b, values_a, alternative='two-sided').statistic
+        self.assertAlmostEqual(u, expected_u, places=9)
+        self.assertAlmostEqual(probability, expected_u / (len(values_a) * len(values_b)), places=12)
+
+
+if __name__ == '__main__':
+    unittest.main()
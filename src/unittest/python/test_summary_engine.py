@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from scipy.io import loadmat, savemat
+
+from Benchmarks import ReferenceSummary as reference
+from Benchmarks.SyntheticStudy import generate_diffusion_parameters, get_patient_directory
+from DataAnalysis import DiffusionParameterData as dpd
+from DataAnalysis.PatientFiles import get_diffusion_parameters_file, get_patient_identifier, load_patient
+
+# Checks the vectorised summaries against the original implementation in Benchmarks.ReferenceSummary on a
+# small synthetic cohort with NaN values and empty segments
+
+patient_count = 4
+nan_fraction = 0.05
+# (patient, region) pairs whose segments are exported without values
+empty_segments = [(0, 3), (1, 0), (1, 11), (2, 3)]
+moment_columns = ['Mean', 'Standard Deviation']
+quartile_columns = ['Median', 'Interquartile Range', 'Lower Quartile', 'Upper Quartile']
+
+
+# Writes a synthetic study with some empty segments and returns its patient directories
+def write_study(study_root):
+    directories = []
+    for index in range(patient_count):
+        rng = np.random.default_rng([0, index])
+        data = generate_diffusion_parameters(rng, (5, 40), image_shape=None, nan_fraction=nan_fraction)
+        for patient, region in empty_segments:
+            if patient == index:
+                for param_name in dpd.exported_diffusion_parameters:
+                    data[param_name + dpd.column_ending][0, region]['values'] = np.empty((1, 0))
+        patient_data_directory = get_patient_directory(study_root, index)
+        os.makedirs(os.path.dirname(get_diffusion_parameters_file(patient_data_directory)))
+        savemat(get_diffusion_parameters_file(patient_data_directory), data)
+        directories.append(patient_data_directory)
+    return directories
+
+
+class SummaryEngineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.study_root = tempfile.mkdtemp()
+        cls.directories = write_study(cls.study_root)
+        cls.patient_identifiers = [get_patient_identifier(directory) for directory in cls.directories]
+        cls.reference_entries = {get_patient_identifier(directory): reference.parse_reference_parameters(
+            loadmat(get_diffusion_parameters_file(directory))) for directory in cls.directories}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.study_root)
+
+    def setUp(self):
+        self.registry = dpd.DiffusionParameterData()
+        for directory in self.directories:
+            patient = load_patient(directory)
+            self.registry.add_parameters(patient.diffusion_parameters, patient.identifier, patient.statistics)
+
+    def assert_matches_reference(self, patient_to_regions):
+        summary = self.registry.get_combined_patient_regions_summary(patient_to_regions)
+        expected = reference.get_reference_summary(self.reference_entries, patient_to_regions)
+        self.assertEqual(summary['Diffusion Parameter'].tolist(), expected['Diffusion Parameter'].tolist())
+        np.testing.assert_allclose(summary[moment_columns].to_numpy(dtype=np.float64),
+                                   expected[moment_columns].to_numpy(dtype=np.float64), rtol=1e-12)
+        np.testing.assert_array_equal(summary[quartile_columns].to_numpy(dtype=np.float64),
+                                      expected[quartile_columns].to_numpy(dtype=np.float64))
+
+    def test_global_selection(self):
+        self.assert_matches_reference(self.registry.patient_global)
+
+    def test_region_selections(self):
+        self.assert_matches_reference({self.patient_identifiers[0]: [0, 3, 7]})
+        self.assert_matches_reference({self.patient_identifiers[1]: [0, 11], self.patient_identifiers[2]: [1]})
+        self.assert_matches_reference({patient_identifier: [2, 3, 4] for patient_identifier in
+                                       self.patient_identifiers})
+
+    # Toggling regions updates the cached cohort aggregates rather than rebuilding them
+    def test_region_toggles(self):
+        patient_to_regions = {patient_identifier: [] for patient_identifier in self.patient_identifiers}
+        for patient_identifier, region in [(self.patient_identifiers[0], 3), (self.patient_identifiers[0], 5),
+                                           (self.patient_identifiers[2], 3), (self.patient_identifiers[1], 0),
+                                           (self.patient_identifiers[3], 9)]:
+            patient_to_regions[patient_identifier].append(region)
+            self.assert_matches_reference(patient_to_regions)
+        for patient_identifier, region in [(self.patient_identifiers[0], 3), (self.patient_identifiers[3], 9)]:
+            patient_to_regions[patient_identifier].remove(region)
+            self.assert_matches_reference(patient_to_regions)
+
+    def test_patient_removal(self):
+        selection = {self.patient_identifiers[0]: [0, 1], self.patient_identifiers[2]: [3, 4]}
+        self.assert_matches_reference(self.registry.patient_global)
+        self.assert_matches_reference(selection)
+        self.registry.remove_patient_data(self.patient_identifiers[2])
+        self.assert_matches_reference(self.registry.patient_global)
+        self.assert_matches_reference({self.patient_identifiers[0]: [0, 1]})
+
+
+if __name__ == '__main__':
+    unittest.main()